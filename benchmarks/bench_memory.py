@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+"""
+Measures the memory held by a parsed service definition, i.e. the
+Schema / Link / Path / Relation objects, excluding the raw input.
+"""
+
+import gc
+import argparse
+import tracemalloc
+
+from reschema import yaml_loader, ServiceDef
+from reschema.jsonschema import Entity
+
+from bench_yaml_loader import generate
+
+
+def measure(text):
+    obj = yaml_loader.ordered_load(text)
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    servicedef = ServiceDef()
+    servicedef.parse(obj)
+
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    entities = sum(1 for o in gc.get_objects() if isinstance(o, Entity))
+    return servicedef, entities, after - before
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--types', type=int, default=1500,
+                        help='Number of generated types')
+    args = parser.parse_args()
+
+    servicedef, entities, size = measure(generate(args.types))
+    print("%d entities, %.1f MB, %d bytes per entity" %
+          (entities, size / 1e6, size / entities))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+"""
+Compares load times of the pure-Python and libyaml based loaders
+in reschema.yaml_loader on a generated service definition.
+"""
+
+import sys
+import time
+import argparse
+
+from reschema import settings, yaml_loader
+
+TYPE_TEMPLATE = """\
+   type_{n}:
+      type: object
+      description: "Generated type {n}"
+      properties:
+         id: {{ type: integer, minimum: 0 }}
+         name: {{ type: string, maxLength: 64 }}
+         tags:
+            type: array
+            items: {{ type: string }}
+         owner: {{ $ref: '#/types/type_0' }}
+"""
+
+
+def generate(ntypes):
+    lines = ["$schema: 'http://support.riverbed.com/apis/service_def/2.2'",
+             "id: 'http://support.riverbed.com/apis/bench/1.0'",
+             "provider: 'riverbed'",
+             "name: 'bench'",
+             "version: '1.0'",
+             "types:"]
+    text = '\n'.join(lines) + '\n'
+    return text + ''.join(TYPE_TEMPLATE.format(n=n) for n in range(ntypes))
+
+
+def bench(func, text, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func(text)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--types', type=int, default=1500,
+                        help='Number of generated types')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if yaml_loader.CParser is None:
+        print("PyYAML was built without libyaml, nothing to compare")
+        sys.exit(1)
+
+    text = generate(args.types)
+    print("%d lines" % text.count('\n'))
+
+    for name, func in (('ordered_load', yaml_loader.ordered_load),
+                       ('marked_load', yaml_loader.marked_load)):
+        yaml_loader.USE_LIBYAML = False
+        pure = bench(func, text, args.repeat)
+        yaml_loader.USE_LIBYAML = True
+        settings.LIBYAML_MARKS = True
+        fast = bench(func, text, args.repeat)
+        print("%-14s python %7.3fs  libyaml %7.3fs  speedup %.1fx" %
+              (name, pure, fast, pure / fast))
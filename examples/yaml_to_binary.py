@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+import argparse
+
+from reschema import yaml_loader, binary_loader
+
+"""
+Takes a YAML input file and writes the reschema binary representation
+(see reschema.binary_loader) to an output file.  Load the result with
+ServiceDef.create_from_file('<output>.rsb').
+"""
+
+
+def convert(stream, outstream, marks=False):
+    if marks:
+        yml = yaml_loader.marked_load(stream)
+    else:
+        yml = yaml_loader.ordered_load(stream)
+    binary_loader.dump(yml, outstream, marks=marks)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Convert a YAML service definition to binary')
+    parser.add_argument('-m', '--marks', action='store_true',
+                        help='Include source file / line marks')
+    parser.add_argument('input', help='YAML input file')
+    parser.add_argument('output', help='Binary output file (*.rsb)')
+    args = parser.parse_args()
+
+    with open(args.input, 'r') as f, open(args.output, 'wb') as out:
+        convert(f, out, marks=args.marks)
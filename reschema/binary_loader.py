@@ -0,0 +1,299 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+"""
+A compact binary format for raw service definition input.
+
+The format is a short header followed by a `marshal` payload, which
+loads several times faster than parsing the equivalent YAML or JSON.
+It is intended for deployment artifacts that don't need to be human
+editable, see `examples/yaml_to_binary.py` for a converter.
+
+Marks are optional.  When present, they are stored as one flat array
+of integers, six per marked node (start index/line/column and end
+index/line/column), in the order the nodes are visited by a pre-order
+walk of the data: a dict, then each of its keys followed by the value,
+a list followed by its items.  `marked_load` walks the data in the same
+order to rebuild dict_node/list_node/str_node instances.
+
+Values other than dicts, lists, strings, numbers, booleans, bytes and
+None are not supported by `marshal`.  Dates and timestamps, as loaded
+from unquoted YAML scalars, are stored as `(EXT_TAG, kind, isoformat)`
+tuples and converted back when loaded.  Other values raise
+`UnsupportedValue`.
+
+Files are memory mapped when read, so the payload is decoded straight
+from the page cache without first copying the file into a buffer.
+"""
+
+import mmap
+import marshal
+import datetime
+from array import array
+
+from yaml.error import Mark
+
+from reschema.loader_nodes import dict_node, list_node, str_node
+
+MAGIC = b'RSCB'
+VERSION = 2
+HEADER_LEN = len(MAGIC) + 2
+
+# Versions that can be read, version 1 files have no FLAG_EXT
+VERSIONS = (1, 2)
+
+FLAG_MARKS = 0x01
+FLAG_EXT = 0x02
+
+# Number of integers stored per mark, see module docstring
+_MARK_INTS = 6
+
+# First item of the tuples that encode values marshal can't store
+EXT_TAG = '__reschema_ext__'
+
+# Types marshal stores as is
+_SCALAR_TYPES = (type(None), bool, int, float, bytes)
+
+
+class UnsupportedValue(ValueError):
+    """A value that can't be stored in the binary format."""
+
+    def __init__(self, value):
+        super(UnsupportedValue, self).__init__(value)
+        self.value = value
+        # Keys / indexes from the root of the data to value
+        self.path = []
+
+    def __str__(self):
+        return ("Unsupported %s value at '#/%s': %r" %
+                (type(self.value).__name__,
+                 '/'.join(str(p) for p in self.path), self.value))
+
+
+def _plain(obj, marks=None, ext=None):
+    """Return obj as builtin dicts/lists/strs, optionally collecting marks.
+
+    marshal only handles the exact builtin types, so subclasses such
+    as OrderedDict and the marked node classes are converted here.
+    Dates and timestamps are encoded, setting `ext[0]` to True.
+    """
+    def add_mark(o):
+        if marks is not None:
+            start = getattr(o, 'start_mark', None)
+            end = getattr(o, 'end_mark', start)
+            if start is None:
+                marks.extend((-1, -1, -1, -1, -1, -1))
+            else:
+                marks.extend((start.index, start.line, start.column,
+                              end.index, end.line, end.column))
+
+    if isinstance(obj, dict):
+        add_mark(obj)
+        result = {}
+        for k, v in obj.items():
+            add_mark(k)
+            try:
+                if isinstance(k, str):
+                    k = str(k)
+                elif not isinstance(k, _SCALAR_TYPES):
+                    k = _plain(k, None, ext)
+                result[k] = _plain(v, marks, ext)
+            except UnsupportedValue as e:
+                e.path.insert(0, k)
+                raise
+        return result
+
+    elif isinstance(obj, (list, tuple)):
+        # tuples are only found in !!omap / !!pairs lists
+        if isinstance(obj, list):
+            add_mark(obj)
+        result = []
+        for i, v in enumerate(obj):
+            try:
+                result.append(_plain(v, marks, ext))
+            except UnsupportedValue as e:
+                e.path.insert(0, i)
+                raise
+        return result if isinstance(obj, list) else tuple(result)
+
+    elif isinstance(obj, str):
+        add_mark(obj)
+        return str(obj)
+
+    elif isinstance(obj, _SCALAR_TYPES):
+        return obj
+
+    elif isinstance(obj, datetime.date):
+        # Includes datetime.datetime
+        if ext is not None:
+            ext[0] = True
+        return (EXT_TAG, type(obj).__name__, obj.isoformat())
+
+    raise UnsupportedValue(obj)
+
+
+def _ext_value(obj):
+    """Return the value encoded by `_plain()` as obj, or obj."""
+    if len(obj) == 3 and obj[0] == EXT_TAG:
+        if obj[1] == 'datetime':
+            return datetime.datetime.fromisoformat(obj[2])
+        return datetime.date.fromisoformat(obj[2])
+    return obj
+
+
+def _decode(obj):
+    """Return obj with the values encoded by `_plain()` restored."""
+    if isinstance(obj, dict):
+        if any(isinstance(k, tuple) for k in obj):
+            obj = dict((_ext_value(k), v) for k, v in obj.items())
+        for k, v in obj.items():
+            if isinstance(v, (dict, list, tuple)):
+                obj[k] = _decode(v)
+    elif isinstance(obj, list):
+        for i, v in enumerate(obj):
+            if isinstance(v, (dict, list, tuple)):
+                obj[i] = _decode(v)
+    elif isinstance(obj, tuple):
+        obj = _ext_value(obj)
+        if isinstance(obj, tuple):
+            obj = tuple(_decode(v) for v in obj)
+    return obj
+
+
+def dump(obj, stream, marks=False):
+    """Write obj to the binary stream in the reschema binary format.
+
+    :param obj: raw input as returned by one of the yaml or json loaders
+    :param stream: a file object opened in binary mode
+    :param marks: if True, also store the marks attached to obj, if any
+    :raises UnsupportedValue: if obj contains a value that can't be
+        stored, such as a set
+
+    """
+    name = ''
+    ext = [False]
+    if marks:
+        mark_ints = array('q')
+        data = _plain(obj, mark_ints, ext)
+        if hasattr(obj, 'start_mark') and obj.start_mark.name:
+            name = obj.start_mark.name
+        payload = (data, name, mark_ints.tobytes())
+        flags = FLAG_MARKS
+    else:
+        payload = (_plain(obj, ext=ext), name, b'')
+        flags = 0
+    if ext[0]:
+        flags |= FLAG_EXT
+
+    stream.write(MAGIC + bytes((VERSION, flags)))
+    stream.write(marshal.dumps(payload))
+
+
+def dumps(obj):
+    """Return obj, without marks, as a compact bytes object.
+
+    Unlike `dump()` there is no header, the result is meant to be
+    kept in memory and decoded by `loads()`.  Raises `UnsupportedValue`
+    like `dump()`.
+    """
+    ext = [False]
+    data = _plain(obj, ext=ext)
+    return marshal.dumps((data, ext[0]))
+
+
+def loads(data):
+    """Return the data encoded by `dumps()`."""
+    data, ext = marshal.loads(data)
+    return _decode(data) if ext else data
+
+
+def _read(stream):
+    """Return (data, name, marks, ext) decoded from stream."""
+    try:
+        mm = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError):
+        # Not a real file (or an empty one), read it all
+        mm = None
+        buf = stream.read()
+    else:
+        buf = mm
+
+    try:
+        if bytes(buf[:len(MAGIC)]) != MAGIC:
+            raise ValueError('Not a reschema binary file')
+        if buf[len(MAGIC)] not in VERSIONS:
+            raise ValueError('Unsupported reschema binary version: %d' %
+                             buf[len(MAGIC)])
+        ext = bool(buf[len(MAGIC) + 1] & FLAG_EXT)
+        view = memoryview(buf)[HEADER_LEN:]
+        try:
+            data, name, mark_bytes = marshal.loads(view)
+        finally:
+            view.release()
+    finally:
+        if mm is not None:
+            mm.close()
+
+    marks = None
+    if mark_bytes:
+        marks = array('q')
+        marks.frombytes(mark_bytes)
+    return data, name, marks, ext
+
+
+def ordered_load(stream):
+    """Load data from stream, ignoring any stored marks."""
+    data, name, marks, ext = _read(stream)
+    return _decode(data) if ext else data
+
+
+def marked_load(stream):
+    """Load data from stream, attaching marks if the file has them."""
+    data, name, marks, ext = _read(stream)
+    if marks is None:
+        return _decode(data) if ext else data
+
+    pos = [0]
+
+    def next_marks():
+        i = pos[0]
+        pos[0] = i + _MARK_INTS
+        if marks[i] < 0:
+            return None, None
+        start = Mark(name, marks[i], marks[i + 1], marks[i + 2], None, None)
+        end = Mark(name, marks[i + 3], marks[i + 4], marks[i + 5],
+                   None, None)
+        return start, end
+
+    def build(obj):
+        if isinstance(obj, dict):
+            start, end = next_marks()
+            items = []
+            for k, v in obj.items():
+                kstart, kend = next_marks()
+                if isinstance(k, str):
+                    k = str_node(k, kstart, kend)
+                elif ext and isinstance(k, tuple):
+                    k = _ext_value(k)
+                items.append((k, build(v)))
+            return dict_node(items, start, end)
+
+        elif isinstance(obj, list):
+            start, end = next_marks()
+            return list_node([build(v) for v in obj], start, end)
+
+        elif isinstance(obj, str):
+            start, end = next_marks()
+            return str_node(obj, start, end)
+
+        elif isinstance(obj, tuple):
+            obj = _ext_value(obj) if ext else obj
+            if isinstance(obj, tuple):
+                return tuple(build(v) for v in obj)
+
+        return obj
+
+    return build(data)
@@ -0,0 +1,201 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+"""
+This module implements a persistent on-disk cache of parsed service
+definitions.
+
+Entries are keyed by a hash of the source file contents, the reschema
+version, the load settings and the `ServiceDef` options that affect
+parsing, so a stale entry is simply never found again.  The cache is
+enabled for `ServiceDef.load()` by setting `reschema.settings.CACHE_DIR`
+(or the `RESCHEMA_CACHE_DIR` environment variable).
+
+Only freshly parsed definitions are stored: references are resolved
+lazily, so at that point the object graph does not point into any other
+service definition and can be serialized on its own.
+
+Entries are pickles, and loading a pickle can run arbitrary code, so
+the cache directory must be a private location that only the user
+running reschema can write.  It is created with mode 0700.  On POSIX
+systems, the cache is not used if the directory or an entry is owned
+by another user, or if the directory is writable by group or others.
+"""
+
+import os
+import sys
+import stat
+import pickle
+import hashlib
+import logging
+import tempfile
+
+from reschema.jsonschema import Schema
+import reschema.settings
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of cached entries changes
+CACHE_FORMAT = 8
+
+# ServiceDef options that affect the parsed result, part of the key
+OPTIONS = ('readonly_input', 'release_input', 'lazy', 'lean')
+
+# ServiceDef attributes not stored, those of the loading instance are
+# kept
+EXCLUDED = OPTIONS + ('manager', 'schemas', '_merges', 'source_file',
+                      '_source_stat')
+
+
+def _reschema_version():
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+        try:
+            return version('reschema')
+        except PackageNotFoundError:
+            pass
+    except ImportError:
+        pass
+    return 'dev'
+
+
+class _Pickler(pickle.Pickler):
+    """Pickler that stores the root servicedef and its manager by name."""
+
+    def __init__(self, f, servicedef):
+        super(_Pickler, self).__init__(f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.servicedef = servicedef
+
+    def persistent_id(self, obj):
+        if obj is self.servicedef:
+            return 'servicedef'
+        if obj is not None and obj is self.servicedef.manager:
+            return 'manager'
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+
+    def __init__(self, f, servicedef):
+        super(_Unpickler, self).__init__(f)
+        self.servicedef = servicedef
+
+    def persistent_load(self, pid):
+        if pid == 'servicedef':
+            return self.servicedef
+        if pid == 'manager':
+            return self.servicedef.manager
+        raise pickle.UnpicklingError('Unknown persistent id: %s' % pid)
+
+
+class ServiceDefCache(object):
+    """ Directory of pickled, fully parsed ServiceDef instances.
+
+    :param directory: where cache entries are kept, created on demand
+
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def key(self, servicedef, filename):
+        """ Return the cache key for the current contents of `filename`.
+
+        :param servicedef: the ServiceDef to load, its options are part
+            of the key
+
+        """
+        h = hashlib.sha256()
+        h.update(('%d:%s:%s:%d:%d:%s\0' %
+                  (CACHE_FORMAT, _reschema_version(),
+                   '.'.join(str(v) for v in sys.version_info[:2]),
+                   reschema.settings.MARKED_LOAD,
+                   reschema.settings.LOAD_DESCRIPTIONS,
+                   ''.join(str(int(bool(getattr(servicedef, name))))
+                           for name in OPTIONS))).encode('utf-8'))
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, '%s.pickle' % key)
+
+    @staticmethod
+    def _trusted(st):
+        """ Return True if the file with stat `st` is safe to use. """
+        if not hasattr(os, 'getuid'):
+            return True
+        return st.st_uid == os.getuid() and not (
+            stat.S_ISDIR(st.st_mode) and st.st_mode & 0o022)
+
+    def _check_directory(self):
+        """ Return True if the cache directory is private, see above. """
+        try:
+            st = os.stat(self.directory)
+        except FileNotFoundError:
+            return True
+        if self._trusted(st):
+            return True
+        logger.warning("Not using cache directory %s, it must be owned "
+                       "by the current user and not writable by others" %
+                       self.directory)
+        return False
+
+    def load(self, servicedef, key):
+        """ Populate `servicedef` from the entry for `key`.
+
+        :return: True if found, False on a cache miss or unreadable entry
+
+        """
+        if not self._check_directory():
+            return False
+        try:
+            with open(self.path(key), 'rb') as f:
+                if not self._trusted(os.fstat(f.fileno())):
+                    logger.warning("Ignoring cache entry %s owned by "
+                                   "another user" % self.path(key))
+                    return False
+                state, schemas = _Unpickler(f, servicedef).load()
+        except FileNotFoundError:
+            return False
+        except Exception:
+            logger.warning("Ignoring unreadable cache entry: %s" %
+                           self.path(key), exc_info=True)
+            return False
+
+        for name in EXCLUDED:
+            state.pop(name, None)
+        servicedef.__dict__.update(state)
+
+        # Rebuild the registry of schemas by id
+        for schema in schemas:
+            servicedef.schemas[schema.id] = schema
+        Schema.servicedefs[servicedef.id] = servicedef
+
+        logger.debug("Loaded %s from cache %s" % (servicedef.id, key))
+        return True
+
+    def store(self, servicedef, key):
+        """ Write a freshly parsed `servicedef` as the entry for `key`. """
+        state = dict((k, v) for (k, v) in servicedef.__dict__.items()
+                     if k not in EXCLUDED)
+        schemas = [e for e in servicedef.entity_iter()
+                   if isinstance(e, Schema)]
+
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        if not self._check_directory():
+            return
+        fd, tmpname = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                _Pickler(f, servicedef).dump((state, schemas))
+            os.replace(tmpname, self.path(key))
+        except Exception:
+            logger.warning("Failed to write cache entry for %s" %
+                           servicedef.id, exc_info=True)
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
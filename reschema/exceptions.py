@@ -4,7 +4,7 @@
 # accompanying the software ("License").  This software is distributed "AS IS"
 # as set forth in the License.
 
-from reschema.loader_nodes import obj_key_node
+from reschema.loader_nodes import obj_key_node, get_marks, has_marks
 
 
 #
@@ -39,6 +39,11 @@ class DuplicateServiceId(ReschemaException):
         return "Service definition already registered by id: %s" % self.id_
 
 
+class UnsupportedUpdate(ReschemaException):
+    """ Service definition can't be updated in place. """
+    pass
+
+
 class NoContext(ReschemaException):
     """ A relative reference was provided with no supporting context. """
 
@@ -81,15 +86,13 @@ class MarkedError(ReschemaException):
         self.message = message
         super(MarkedError, self).__init__(message)
 
-        if hasattr(obj, 'start_mark'):
+        if has_marks(obj):
             self.obj = obj
-            self.start_mark = obj.start_mark
-            self.end_mark = obj.end_mark
+            self.start_mark, self.end_mark = get_marks(obj)
         elif (  parent_obj and (obj in parent_obj) and
-                hasattr(parent_obj, 'start_mark')):
+                has_marks(parent_obj)):
             self.obj = obj_key_node(parent_obj, obj)
-            self.start_mark = self.obj.start_mark
-            self.end_mark = self.obj.end_mark
+            self.start_mark, self.end_mark = get_marks(self.obj)
         else:
             self.start_mark = None
             self.end_mark = None
@@ -4,15 +4,23 @@
 # accompanying the software ("License").  This software is distributed "AS IS"
 # as set forth in the License.
 
+import re
 import json
 from io import StringIO
+from bisect import bisect_left
 from yaml.error import Mark
-from json.scanner import py_make_scanner
+from json.scanner import NUMBER_RE
+from json.decoder import (JSONDecodeError, WHITESPACE, WHITESPACE_STR,
+                          scanstring)
 import json.decoder
 
+from reschema import loader_nodes
 from reschema.loader_nodes import dict_node, list_node, str_node
 
 
+NEWLINE = re.compile('\n')
+
+
 def linecol(doc, pos):
     # assume zero-indexed
     lineno = doc.count('\n', 0, pos)
@@ -23,50 +31,230 @@ def linecol(doc, pos):
     return lineno, colno
 
 
-class Decoder(json.decoder.JSONDecoder):
-    def __init__(self, name="", *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
-        def wrap_obj_parser(parser, node_type):
-            def internal(o_and_start, *args, **kwargs):
-                o, start = o_and_start
-                r, end = parser(o_and_start, *args, **kwargs)
-
-                start_line, start_col = linecol(o, start)
-                end_line, end_col = linecol(o, end)
-                start_mark = Mark(name, start, start_line, start_col, o, start)
-                end_mark = Mark(name, end, end_line, end_col, o, start)
-
-                return node_type(r, start_mark, end_mark), end
-            return internal
-
-        def wrap_parser(parser, node_type):
-            def internal(o, start, *args, **kwargs):
-                r, end = parser(o, start, *args, **kwargs)
+class LineIndex(object):
+    """Newline offsets of a document for computing line / column.
+
+    Built once per document, after which `linecol` is a binary search
+    rather than a scan of the document up to `pos`.
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.newlines = [m.start() for m in NEWLINE.finditer(doc)]
+
+    def linecol(self, pos):
+        """Same as the module level `linecol(self.doc, pos)`."""
+        lineno = bisect_left(self.newlines, pos)
+        if lineno == 0:
+            colno = pos - 1
+        else:
+            colno = pos - self.newlines[lineno - 1] - 1
+        return lineno, colno
+
+
+class MarkTable(loader_nodes.MarkTable):
+    """MarkTable computing line / column the same way as `linecol`."""
+
+    def linecol(self, index):
+        if self._newlines is None:
+            self._newlines = LineIndex(self.buffer)
+        return self._newlines.linecol(index)
+
+
+def make_marked_scanner(context, name="", mark_table=None):
+    """Return a scan_once function that attaches marks to parsed nodes.
+
+    This is a self-contained equivalent of `json.scanner.py_make_scanner`
+    and the object / array parsers from `json.decoder`.  Strings are
+    decoded by the (C accelerated) `json.decoder.scanstring`, and every
+    string, key, array and object is returned as a marked node.
+
+    If `mark_table` is given, plain objects are returned instead and
+    their offsets are recorded in the `loader_nodes.MarkTable`.
+
+    All state is local to the returned function, so nothing global is
+    patched and separate scanners may be used concurrently.
+    """
+    parse_float = context.parse_float
+    parse_int = context.parse_int
+    parse_constant = context.parse_constant
+    object_hook = context.object_hook
+    object_pairs_hook = context.object_pairs_hook
+    strict = context.strict
+    match_number = NUMBER_RE.match
+    ws = WHITESPACE.match
+    index = [None]
+
+    def node(node_type, obj, s, start, end):
+        if mark_table is not None:
+            mark_table.add(obj, start, end)
+            return obj
+        return node_type(obj, *marks(s, start, end))
+
+    def marks(s, start, end):
+        if index[0] is None or index[0].doc is not s:
+            index[0] = LineIndex(s)
+        start_line, start_col = index[0].linecol(start)
+        end_line, end_col = index[0].linecol(end)
+        return (Mark(name, start, start_line, start_col, s, start),
+                Mark(name, end, end_line, end_col, s, start))
+
+    def parse_string(s, start):
+        r, end = scanstring(s, start, strict)
+        return node(str_node, r, s, start, end), end
+
+    def parse_object(s, end):
+        start = end
+        pairs = []
+        nextchar = s[end:end + 1]
+        if nextchar != '"':
+            if nextchar in WHITESPACE_STR:
+                end = ws(s, end).end()
+                nextchar = s[end:end + 1]
+            if nextchar == '}':
+                return make_object(s, start, pairs, end + 1)
+            elif nextchar != '"':
+                raise JSONDecodeError(
+                    "Expecting property name enclosed in double quotes",
+                    s, end)
+        end += 1
+        while True:
+            key, end = parse_string(s, end)
+            if s[end:end + 1] != ':':
+                end = ws(s, end).end()
+                if s[end:end + 1] != ':':
+                    raise JSONDecodeError("Expecting ':' delimiter", s, end)
+            end += 1
+            if s[end:end + 1] in WHITESPACE_STR:
+                end = ws(s, end).end()
+
+            try:
+                value, end = scan_once(s, end)
+            except StopIteration as err:
+                raise JSONDecodeError("Expecting value", s,
+                                      err.value) from None
+            pairs.append((key, value))
+
+            nextchar = s[end:end + 1]
+            if nextchar and nextchar in WHITESPACE_STR:
+                end = ws(s, end).end()
+                nextchar = s[end:end + 1]
+            end += 1
+            if nextchar == '}':
+                break
+            elif nextchar != ',':
+                raise JSONDecodeError("Expecting ',' delimiter", s, end - 1)
+            end = ws(s, end).end()
+            nextchar = s[end:end + 1]
+            end += 1
+            if nextchar != '"':
+                raise JSONDecodeError(
+                    "Expecting property name enclosed in double quotes",
+                    s, end - 1)
+
+        return make_object(s, start, pairs, end)
+
+    def make_object(s, start, pairs, end):
+        if object_pairs_hook is not None:
+            obj = object_pairs_hook(pairs)
+        else:
+            obj = dict(pairs)
+            if object_hook is not None:
+                obj = object_hook(obj)
+        return node(dict_node, obj, s, start, end), end
+
+    def parse_array(s, end):
+        start = end
+        values = []
+        end = ws(s, end).end()
+        nextchar = s[end:end + 1]
+        if nextchar == ']':
+            end += 1
+        else:
+            while True:
+                try:
+                    value, end = scan_once(s, end)
+                except StopIteration as err:
+                    raise JSONDecodeError("Expecting value", s,
+                                          err.value) from None
+                values.append(value)
+
+                nextchar = s[end:end + 1]
+                if nextchar and nextchar in WHITESPACE_STR:
+                    end = ws(s, end).end()
+                    nextchar = s[end:end + 1]
+                end += 1
+                if nextchar == ']':
+                    break
+                elif nextchar != ',':
+                    raise JSONDecodeError("Expecting ',' delimiter",
+                                          s, end - 1)
+                end = ws(s, end).end()
+
+        return node(list_node, values, s, start, end), end
+
+    def scan_once(s, idx):
+        try:
+            nextchar = s[idx]
+        except IndexError:
+            raise StopIteration(idx) from None
+
+        if nextchar == '"':
+            return parse_string(s, idx + 1)
+        elif nextchar == '{':
+            return parse_object(s, idx + 1)
+        elif nextchar == '[':
+            return parse_array(s, idx + 1)
+        elif nextchar == 'n' and s[idx:idx + 4] == 'null':
+            return None, idx + 4
+        elif nextchar == 't' and s[idx:idx + 4] == 'true':
+            return True, idx + 4
+        elif nextchar == 'f' and s[idx:idx + 5] == 'false':
+            return False, idx + 5
+
+        m = match_number(s, idx)
+        if m is not None:
+            integer, frac, exp = m.groups()
+            if frac or exp:
+                res = parse_float(integer + (frac or '') + (exp or ''))
+            else:
+                res = parse_int(integer)
+            return res, m.end()
+        elif nextchar == 'N' and s[idx:idx + 3] == 'NaN':
+            return parse_constant('NaN'), idx + 3
+        elif nextchar == 'I' and s[idx:idx + 8] == 'Infinity':
+            return parse_constant('Infinity'), idx + 8
+        elif nextchar == '-' and s[idx:idx + 9] == '-Infinity':
+            return parse_constant('-Infinity'), idx + 9
+        else:
+            raise StopIteration(idx)
+
+    return scan_once
 
-                start_line, start_col = linecol(o, start)
-                end_line, end_col = linecol(o, end)
-                start_mark = Mark(name, start, start_line, start_col, o, start)
-                end_mark = Mark(name, end, end_line, end_col, o, start)
 
-                return node_type(r, start_mark, end_mark), end
-            return internal
+class Decoder(json.decoder.JSONDecoder):
+    """JSON decoder returning marked dict/list/str nodes.
+
+    Unlike a plain `json.decoder.JSONDecoder`, decoding runs in Python
+    via `make_marked_scanner`, but module state in `json` is left alone,
+    so other users of `json` keep the C scanner and decoders are
+    safe to use from multiple threads.
+    """
+    def __init__(self, name="", *args, mark_table=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scan_once = make_marked_scanner(self, name, mark_table)
 
-        self.parse_string = wrap_parser(self.parse_string, str_node)
-        self.parse_array = wrap_obj_parser(self.parse_array, list_node)
-        self.parse_object = wrap_obj_parser(self.parse_object, dict_node)
 
-        # Not thread safe, but need to patch this for loading marks onto object
-        # keys.
-        json.decoder.scanstring = self.parse_string
+def marked_load(stream):
+    return json.load(stream, cls=Decoder)
 
-        # Need to hook the python scanner because the C scanner doesn't have
-        # a hookable method to parse_string.
-        self.scan_once = py_make_scanner(self)
 
+def compact_marked_load(stream):
+    """Load plain objects, returning a tuple `(data, MarkTable)`."""
+    text = stream.read()
+    table = MarkTable(getattr(stream, 'name', ''), text)
+    return json.loads(text, cls=Decoder, mark_table=table), table
 
-def marked_load(stream):
-    return json.load(stream, cls=Decoder)
 
 def clean_load(stream):
     return json.load(stream)
@@ -119,6 +307,58 @@ def test_marked_load():
     assert isinstance(d['a'], list)
 
 
+def test_compact_marked_load():
+    from reschema.loader_nodes import get_marks
+
+    def loc(obj):
+        start_mark, end_mark = get_marks(obj)
+        return (start_mark.line, start_mark.column,
+                end_mark.line, end_mark.column)
+
+    d, table = compact_marked_load(StringIO(test_json_str))
+
+    assert d == {'a': ['b', 'c', {'d': 'e'}], 'f': {'g': 'h'}}
+    assert loc(d) == (0, 0, 11, 1)
+    assert loc(d['a']) == (1, 10, 7, 5)
+    assert loc(d['f']) == (8, 10, 10, 5)
+
+    assert type(d['a'][2]['d']) is str
+    assert type(d) is dict
+    assert type(d['a']) is list
+
+
+def test_line_index():
+    index = LineIndex(test_json_str)
+    for pos in range(1, len(test_json_str)):
+        assert index.linecol(pos) == linecol(test_json_str, pos)
+
+
+def test_marked_load_threads():
+    from threading import Thread
+    orig_scanstring = json.decoder.scanstring
+    errors = []
+
+    def load():
+        try:
+            for i in range(20):
+                test_marked_load()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [Thread(target=load) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert json.decoder.scanstring is orig_scanstring
+    assert type(json.loads('{"a": "b"}')['a']) is str
+
+
 if __name__ == '__main__':
     test_clean_load()
     test_marked_load()
+    test_compact_marked_load()
+    test_line_index()
+    test_marked_load_threads()
@@ -16,14 +16,20 @@ only when needed.
 import copy
 import logging
 import json
+import threading
 
 from reschema.parser import Parser
-from reschema.exceptions import ParseError
+from reschema.exceptions import ParseError, InvalidReference
+from reschema.loader_nodes import copy_marks
+from reschema.util import canonical_json
 import reschema.settings
 
 
 logger = logging.getLogger(__name__)
 
+# Keys of the merges being evaluated by the current thread
+_active = threading.local()
+
 
 def isdebug():
     return (reschema.settings.VERBOSE_DEBUG and
@@ -69,16 +75,17 @@ def _eval_shallow(servicedef, obj, need_copy=False):
                 merge_with = merge_parser.parse('with', save=False,
                                                 required=True)
 
-            # This always returns a copy
-            obj = json_merge_patch(servicedef, merge_source, merge_with)
-            is_copy = True
+            # The result is shared, it is copied below if needed
+            obj = merge(servicedef, merge_source, merge_with)
+            is_copy = False
 
         elif '$ref' in obj:
             if len(list(obj.keys())) != 1:
                 raise ParseError(
                     "$ref object may not have any other properties", obj)
 
-            sch = servicedef.find(obj['$ref'])
+            sch = (servicedef.find_schema_by_id(obj['$ref']) or
+                   servicedef.find(obj['$ref']))
             obj = sch.input
             is_copy = False
 
@@ -86,14 +93,84 @@ def _eval_shallow(servicedef, obj, need_copy=False):
             done = True
 
     if not is_copy and need_copy:
-        obj = copy.copy(obj)
+        orig = obj
+        obj = copy.copy(orig)
+        copy_marks(orig, obj)
 
     return obj
 
 
+def merge(servicedef, source, with_):
+    """Return the result of a $merge of source with with_.
+
+    Results are memoized by servicedef, keyed by the canonical form of
+    source and with_, so identical merges are only evaluated once.  The
+    result is shared and must not be modified.
+
+    :raises InvalidReference: if the merge depends on its own result,
+        or if merges of merges are nested more than
+        `reschema.settings.MAX_MERGE_DEPTH` levels deep
+
+    """
+    key = (canonical_json(source), canonical_json(with_))
+    merges = servicedef._merges
+    result = merges.get(key)
+    if result is not None:
+        return result
+
+    active = getattr(_active, 'keys', None)
+    if active is None:
+        active = _active.keys = []
+    if key in active:
+        raise InvalidReference("circular $merge", key[0])
+    if len(active) >= reschema.settings.MAX_MERGE_DEPTH:
+        raise InvalidReference("$merge nested more than %d levels deep" %
+                               reschema.settings.MAX_MERGE_DEPTH, key[0])
+
+    active.append(key)
+    try:
+        result = json_merge_patch(servicedef, source, with_)
+    finally:
+        active.pop()
+
+    merges[key] = result
+    return result
+
+
 def json_merge_patch(servicedef, source, with_):
-    """Return a new dict from source with with_ as a json-merge-patch. """
+    """Return a new dict from source with with_ as a json-merge-patch.
+
+    Only the dicts along the paths modified by with_ are copied, all
+    other values are shared with source and with_.  Nested dicts are
+    merged iteratively, so deeply nested schemas don't run into the
+    recursion limit.
+
+    """
+    isdebug() and logger.debug('JSON merge:\nsource = %s\nwith = %s' %
+                               (json.dumps(source, indent=2),
+                                json.dumps(with_, indent=2)))
 
+    # Each entry merges source with with_ and stores the result as
+    # parent[key].  Until then, parent[key] is the unmerged source.
+    result = [None]
+    stack = [(result, 0, source, with_)]
+    while stack:
+        parent, key, source, with_ = stack.pop()
+        parent[key] = _merge_level(servicedef, source, with_, stack)
+
+    isdebug() and logger.debug('JSON merge result:\n%s' %
+                               (json.dumps(result[0], indent=2)))
+
+    return result[0]
+
+
+def _merge_level(servicedef, source, with_, stack):
+    """Merge the top level of with_ into source.
+
+    Returns the merged dict, and pushes an entry on stack for each key
+    that is a dict in both source and with_.
+
+    """
     if isinstance(source, list) or isinstance(with_, list):
         return with_
 
@@ -103,10 +180,6 @@ def json_merge_patch(servicedef, source, with_):
     if not isinstance(with_, dict):
         raise TypeError('with_ must be a dict, got %s' % (type(with_)))
 
-    isdebug() and logger.debug('JSON merge:\nsource = %s\nwith = %s' %
-                               (json.dumps(source, indent=2),
-                                json.dumps(with_, indent=2)))
-
     if (  '$ref' in source and
           '$ref' in with_ and
           source == with_):
@@ -116,8 +189,8 @@ def json_merge_patch(servicedef, source, with_):
 
     # Need to make a copy of source, as this is going to be modified
     # Only make a shallow copy here - only the shallow properties
-    # are modified in this call.  Recursively deeper calls will make
-    # deeper copies as needed.
+    # are modified at this level.  Deeper levels make their own
+    # copies as needed.
     source = _eval_shallow(servicedef, source, need_copy=True)
 
     # with_ is only used in a readonly fashion, so no need to copy
@@ -131,14 +204,12 @@ def json_merge_patch(servicedef, source, with_):
         elif (  isinstance(value, dict) and
                 key in source and
                 isinstance(source[key], dict)):
-            # If this key is a dict in both source and with_, recurse
-            source[key] = json_merge_patch(servicedef, source[key], value)
+            # If this key is a dict in both source and with_, merge
+            # it once done with this level
+            stack.append((source, key, source[key], value))
         else:
             # Otherwise update the source for this key.  This may add the
             # key to source if it was not already present
             source[key] = value
 
-    isdebug() and logger.debug('JSON merge result:\n%s' %
-                               (json.dumps(source, indent=2)))
-
     return source
@@ -67,7 +67,10 @@ See each individual Schema type for the complete list of validation rules.
 """
 
 import re
+import sys
 import copy
+import hashlib
+import weakref
 import logging
 import xml.etree.ElementTree as ET
 from collections import OrderedDict
@@ -75,13 +78,15 @@ from collections import OrderedDict
 import uritemplate
 from jsonpointer import resolve_pointer, JsonPointer
 
-from reschema.jsonmergepatch import json_merge_patch
+from reschema.jsonmergepatch import merge
+from reschema.loader_nodes import SourceSpan
 from reschema.parser import Parser
 from reschema.util import check_type, uritemplate_required_variables, \
-    uritemplate_add_query_params
+    uritemplate_add_query_params, canonical_json
 from reschema.reljsonpointer import resolve_rel_pointer, JsonPointerException
 from reschema.exceptions import \
-    ValidationError, MissingParameter, ParseError, InvalidReference
+    ValidationError, MissingParameter, ParseError, InvalidReference, \
+    ReschemaException
 
 __all__ = ['Schema']
 
@@ -97,6 +102,205 @@ def _register_type(cls):
     type_map[cls._type] = cls
 
 
+class _FrozenDict(dict):
+    """Immutable dict, for values shared between schemas."""
+    __slots__ = ()
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("shared dict may not be modified")
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    setdefault = update = pop = popitem = clear = _immutable
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+
+class _FrozenList(list):
+    """Immutable list, for values shared between schemas."""
+    __slots__ = ()
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("shared list may not be modified")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = extend = insert = remove = pop = clear = _immutable
+    sort = reverse = _immutable
+
+    def __reduce__(self):
+        return (type(self), (list(self),))
+
+
+class _EmptyDict(_FrozenDict):
+    """Immutable empty dict, shared by entities without relations/links."""
+    __slots__ = ()
+
+    def __reduce__(self):
+        return '_EMPTY_DICT'
+
+
+class _EmptyList(_FrozenList):
+    """Immutable empty list, shared by schemas without anyOf/allOf/oneOf."""
+    __slots__ = ()
+
+    def __reduce__(self):
+        return '_EMPTY_LIST'
+
+
+def _frozen(value):
+    """Return a plain immutable copy of an input value.
+
+    Marked nodes are replaced by plain values, so the copy doesn't
+    keep the marks, and through them the source document, alive.
+    """
+    if isinstance(value, dict):
+        return _FrozenDict((_frozen(k), _frozen(v))
+                           for k, v in value.items())
+    elif isinstance(value, list):
+        return _FrozenList(_frozen(v) for v in value)
+    elif isinstance(value, str) and type(value) is not str:
+        return str(value)
+    return value
+
+
+_EMPTY_DICT = _EmptyDict()
+_EMPTY_LIST = _EmptyList()
+
+_slot_names_cache = {}
+
+
+def _constraints_key(values):
+    """Return a hashable key for a dict of validation keywords.
+
+    Unlike the values themselves, keys tell apart 1, 1.0 and True.
+    """
+    key = []
+    for name, value in values.items():
+        if isinstance(value, (list, dict)):
+            value = canonical_json(value)
+        elif isinstance(value, str):
+            value = str(value)
+        key.append((name, type(value), value))
+    return tuple(key)
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class _Constraints(object):
+    """Immutable record of the validation keywords of a schema.
+
+    Records are interned, so all schemas with the same keywords share
+    one record along with values derived from it, such as the
+    compiled `pattern`.  Use `_Constraints.intern()` to create one.
+    """
+    __slots__ = ('values', 'key', '_compiled', '__weakref__')
+
+    # Map of key to live record
+    _pool = weakref.WeakValueDictionary()
+
+    def __init__(self, values, key):
+        self.values = values
+        self.key = key
+        self._compiled = None
+
+    @classmethod
+    def intern(cls, values):
+        """Return the shared record for the dict `values`.
+
+        The record holds plain immutable copies of the values, see
+        `_frozen()`.
+        """
+        values = dict((name, _frozen(value))
+                      for name, value in values.items())
+        key = _constraints_key(values)
+        record = cls._pool.get(key)
+        if record is None:
+            record = cls(values, key)
+            cls._pool[key] = record
+        return record
+
+    def replace(self, name, value):
+        """Return the record with `name` set to `value`."""
+        values = dict(self.values)
+        values[name] = value
+        return _Constraints.intern(values)
+
+    @property
+    def pattern(self):
+        """The compiled 'pattern' keyword."""
+        if self._compiled is None:
+            self._compiled = re.compile(self.values['pattern'])
+        return self._compiled
+
+    def __reduce__(self):
+        return (_Constraints.intern, (self.values,))
+
+
+def _constraint(name):
+    """Return a property for the validation keyword `name`.
+
+    The value is kept in the shared `_Constraints` record of the
+    schema, setting it replaces the record.  Values are immutable
+    copies of the input, lists and dicts may not be modified.  Setting
+    it raises ReschemaException once the servicedef is frozen.
+    """
+    def fget(self):
+        return self._constraints.values[name]
+
+    def fset(self, value):
+        if getattr(self.servicedef, 'frozen', False):
+            raise ReschemaException(
+                "%s: can't set '%s', service definition is frozen" %
+                (self.fullname(), name))
+        self._constraints = self._constraints.replace(name, value)
+        # The fingerprints of this schema and its parents change
+        e = self
+        while e is not None:
+            if isinstance(e, Schema):
+                e._fingerprint = None
+            e = e.parent
+
+    return property(fget, fset, doc='Validation keyword %r' % name)
+
+
+def _doc_field(name):
+    """Return a property for the documentation-only attribute `name`.
+
+    The value is kept in slot '_<name>'.  For a lean servicedef the
+    slot may hold a SourceSpan, the value is then read back from the
+    source by `ServiceDef.read_source()` on every access.
+    """
+    slot = '_' + name
+
+    def fget(self):
+        # Bypass DynamicSchema.__getattr__, an unset slot must raise
+        # AttributeError for `name` so that a Ref forwards `name`
+        value = object.__getattribute__(self, slot)
+        if isinstance(value, SourceSpan):
+            return self.servicedef.read_source(value)
+        return value
+
+    def fset(self, value):
+        object.__setattr__(self, slot, value)
+
+    return property(fget, fset, doc='Documentation field %r' % name)
+
+
+def _slot_names(cls):
+    """Return the set of all attribute slots of cls and its bases."""
+    try:
+        return _slot_names_cache[cls]
+    except KeyError:
+        pass
+    names = frozenset(name for c in cls.__mro__
+                      for name in getattr(c, '__slots__', ())
+                      if name != '__weakref__')
+    _slot_names_cache[cls] = names
+    return names
+
+
 class Entity(object):
     """Base for various classes using ids and names
 
@@ -119,13 +323,26 @@ class Entity(object):
         used by non-Schema entities.
 
     :param input: parsing data relevant for error reporting, if any.
+
+    Entities and all subclasses use `__slots__`, every attribute that
+    may be set, including those set by `Parser.parse()`, must be
+    listed in `__slots__` of the class.
     """
+    __slots__ = ('id', 'name', 'parent', 'servicedef', '_intermediary',
+                 '_absolute_id', '_fullname', 'start_mark', 'end_mark',
+                 '__weakref__')
+
     def __init__(self, id, name=None, parent=None, servicedef=None,
                  intermediary=None, input=None):
         self.id = id
         self.name = name
         self.parent = parent
         self.servicedef = servicedef
+        self._intermediary = intermediary
+
+        # Computed on first use by fullid() / fullname()
+        self._absolute_id = None
+        self._fullname = None
 
         if servicedef is None:
             if parent is None:
@@ -138,35 +355,48 @@ class Entity(object):
                     "Must specify 'servicedef' if parent is None", input)
             self.servicedef = parent.servicedef
 
-        self._absolute_id = '%s%s' % (self.servicedef.id, self.id)
-
-        if self.parent:
-            if self.name is None:
-                self._fullname = self.parent.fullname()
-            elif intermediary is not None:
-                self._fullname = '.'.join((self.parent.fullname(),
-                                           intermediary, self.name))
-            elif isinstance(self.parent, Array):
-                self._fullname = '%s[%s]' % (self.parent.fullname(), self.name)
-            elif self.parent.fullname() is None:
-                self._fullname = self.name
-            else:
-                self._fullname = '.'.join((self.parent.fullname(), self.name))
-
-        elif self.parent is None and self.name is None:
-            self._fullname = None
-        else:
-            self._fullname = self.name
-
     def __repr__(self):
         return "<servicedef.%s '%s'>" % (self.__class__.__name__,
                                          self.fullid())
 
+    def __getstate__(self):
+        # Only slots that are set, read without triggering
+        # DynamicSchema.__getattr__
+        state = {}
+        for name in _slot_names(type(self)):
+            try:
+                state[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
     def fullname(self):
         """Return the full printable name using dotted notation."""
         # Note: Could be property, but is a method for historical reasons.
+        if self._fullname is None:
+            self._fullname = self._make_fullname()
         return self._fullname
 
+    def _make_fullname(self):
+        if self.parent:
+            if self.name is None:
+                return self.parent.fullname()
+            elif self._intermediary is not None:
+                return '.'.join((self.parent.fullname(),
+                                 self._intermediary, self.name))
+            elif isinstance(self.parent, Array):
+                return '%s[%s]' % (self.parent.fullname(), self.name)
+            elif self.parent.fullname() is None:
+                return self.name
+            else:
+                return '.'.join((self.parent.fullname(), self.name))
+
+        return self.name
+
     def fullid(self, relative=False):
         """Return the full id (canonical URI) using path notation.
 
@@ -174,7 +404,11 @@ class Entity(object):
             servicedef
         """
         # Note: Could be property, but is a method for historical reasons.
-        return self.id if relative else self._absolute_id
+        if relative:
+            return self.id
+        if self._absolute_id is None:
+            self._absolute_id = '%s%s' % (self.servicedef.id, self.id)
+        return self._absolute_id
 
 
 class Schema(Entity):
@@ -220,11 +454,24 @@ class Schema(Entity):
         encountered while parsing.
     """
 
+    __slots__ = ('_typestr', 'children', '_input', 'label', '_description',
+                 '_notes', '_example', 'readOnly', '_tags', 'xmlTag',
+                 '_xmlSchema', '_xmlExample', 'xmlKeyName', 'relations',
+                 'links', 'anyof', 'allof', 'oneof', 'not_', '_fingerprint')
+
+    description = _doc_field('description')
+    notes = _doc_field('notes')
+    example = _doc_field('example')
+    tags = _doc_field('tags')
+    xmlSchema = _doc_field('xmlSchema')
+    xmlExample = _doc_field('xmlExample')
+
     # Counter used for assigning names/ids for anonymous types
     count = 1
 
-    # Map of all known schemas by id
-    schemas = {}
+    # Map of live service definitions by id, consulted by find_by_id().
+    # Each ServiceDef keeps its own registry of schemas.
+    servicedefs = weakref.WeakValueDictionary()
 
     def __init__(self, typestr, parser, name=None,
                  parent=None, servicedef=None, id=None):
@@ -234,6 +481,7 @@ class Schema(Entity):
 
         self._typestr = typestr
         self.children = []
+        self._fingerprint = None
 
         # Save the original input object that was parsed, other
         # references may want this later.
@@ -243,65 +491,51 @@ class Schema(Entity):
         self.input = parser.input
 
         # Give the Parser context now that this object is created
-        # for setting attributes and logging messages
-        parser.set_context(self.fullname(), self)
+        # for setting attributes and logging messages, the parser
+        # uses our fullname() only when needed
+        parser.set_context(None, self)
 
         if not self.is_ref():
             parser.parse('label', name, types=str)
-            parser.parse('description', '', types=str)
-            parser.parse('notes', '', types=str)
-            parser.parse('example')
+            parser.parse('description', '', types=str, doc=True)
+            parser.parse('notes', '', types=str, doc=True)
+            parser.parse('example', doc=True)
             readOnlyDef = (parent.readOnly
                            if (parent and isinstance(parent, Schema))
                            else False)
             parser.parse('readOnly', readOnlyDef, types=bool)
-            parser.parse('tags', {}, types=dict)
+            parser.parse('tags', {}, types=dict, doc=True)
             parser.parse('xmlTag')
-            parser.parse('xmlSchema')
-            parser.parse('xmlExample')
+            parser.parse('xmlSchema', doc=True)
+            parser.parse('xmlExample', doc=True)
             parser.parse('xmlKeyName')
 
-            self.relations = OrderedDict()
-            for key, value in parser.parse('relations', {},
-                                           types=dict, save=False).items():
-                check_type(key, value, dict)
-                self.relations[key] = Relation(value, key, self,
-                                               id=('%s/relations/%s' %
-                                                   (self.id, key)))
-
-            self.links = OrderedDict()
+            # Empty containers are shared, only allocate when needed
+            self.relations = _EMPTY_DICT
+            relations = parser.parse('relations', {}, types=dict, save=False)
+            if relations:
+                self.relations = OrderedDict()
+                for key, value in relations.items():
+                    check_type(key, value, dict)
+                    self.relations[key] = Relation(value, key, self,
+                                                   id=('%s/relations/%s' %
+                                                       (self.id, key)))
+
+            self.links = _EMPTY_DICT
             links = parser.parse('links', {}, types=dict, save=False)
-            links_keys = Link.order_link_keys(list(links.keys()))
-
-            for key in links_keys:
-                value = links[key]
-                check_type(key, value, dict)
-                self.links[key] = Link(value, key, self,
-                                       id='%s/links/%s' % (self.id, key))
-
-            self.anyof = []
-            for i, subinput in enumerate(parser.parse('anyOf', [],
-                                                      types=list, save=False)):
-                s = Schema.parse(subinput, parent=self, name='anyOf[%d]' % i,
-                                 id='%s/anyOf/%d' % (self.id, i))
-                self.anyof.append(s)
-                self.children.append(s)
-
-            self.allof = []
-            for i, subinput in enumerate(parser.parse('allOf', [],
-                                                      types=list, save=False)):
-                s = Schema.parse(subinput, parent=self, name='allOf[%d]' % i,
-                                 id='%s/allOf/%d' % (self.id, i))
-                self.allof.append(s)
-                self.children.append(s)
-
-            self.oneof = []
-            for i, subinput in enumerate(parser.parse('oneOf', [],
-                                                      types=list, save=False)):
-                s = Schema.parse(subinput, parent=self, name='oneOf[%d]' % i,
-                                 id='%s/oneOf/%d' % (self.id, i))
-                self.oneof.append(s)
-                self.children.append(s)
+            if links:
+                self.links = OrderedDict()
+                links_keys = Link.order_link_keys(list(links.keys()))
+
+                for key in links_keys:
+                    value = links[key]
+                    check_type(key, value, dict)
+                    self.links[key] = Link(value, key, self,
+                                           id='%s/links/%s' % (self.id, key))
+
+            self.anyof = self._parse_list(parser, 'anyOf', 'anyof')
+            self.allof = self._parse_list(parser, 'allOf', 'allof')
+            self.oneof = self._parse_list(parser, 'oneOf', 'oneof')
 
             n = parser.parse('not', save=False)
             if n is not None:
@@ -311,7 +545,38 @@ class Schema(Entity):
             else:
                 self.not_ = None
 
-        self.schemas[self.fullid()] = self
+        self.servicedef.schemas[self.id] = self
+
+    @property
+    def input(self):
+        """The raw input this schema was parsed from.
+
+        If the servicedef released its input after parsing (see
+        `ServiceDef.release_input`), it is rebuilt, without marks,
+        from the compact copy kept by the servicedef.
+        """
+        if self._input is None:
+            return self.servicedef.released_input(self.id)
+        return self._input
+
+    @input.setter
+    def input(self, value):
+        self._input = value
+
+    def _parse_list(self, parser, prop, attr):
+        """Parse a list of sub-schemas such as 'anyOf'."""
+        inputs = parser.parse(prop, [], types=list, save=False)
+        if not inputs:
+            return _EMPTY_LIST
+
+        result = []
+        for i, subinput in enumerate(inputs):
+            s = Schema.parse(subinput, parent=self,
+                             name=sys.intern('%s[%d]' % (prop, i)),
+                             id='%s/%s/%d' % (self.id, prop, i))
+            result.append(s)
+            self.children.append(s)
+        return result
 
     @classmethod
     def parse(cls, input, name=None, parent=None, servicedef=None,
@@ -379,12 +644,16 @@ class Schema(Entity):
 
     @classmethod
     def find_by_id(cls, id):
-        """Find a schema by fullid."""
-
-        if id in cls.schemas:
-            return cls.schemas[id]
+        """Find a schema by fullid in any live service definition.
 
-        return None
+        Prefer `ServiceDef.find_schema_by_id()`, which resolves
+        other service definitions through the manager.
+        """
+        base, _, fragment = id.partition('#')
+        servicedef = cls.servicedefs.get(base)
+        if servicedef is None:
+            return None
+        return servicedef.schema_by_id('#' + fragment)
 
     @property
     def typestr(self):
@@ -411,6 +680,29 @@ class Schema(Entity):
         to combine multiple schema definitions."""
         return False
 
+    def fingerprint(self):
+        """Return a structural hash of this schema and its subschemas.
+
+        Names, ids and documentation are ignored, so schemas that
+        validate input the same way, for instance the same type in two
+        versions of a service, have the same fingerprint.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = _digest(canonical_json(self._structure()))
+        return self._fingerprint
+
+    def _structure(self):
+        """Return what `fingerprint()` is computed from."""
+        try:
+            constraints = object.__getattribute__(self, '_constraints').key
+        except AttributeError:
+            constraints = None
+        return [type(self)._type, constraints,
+                [s.fingerprint() for s in self.anyof],
+                [s.fingerprint() for s in self.allof],
+                [s.fingerprint() for s in self.oneof],
+                self.not_.fingerprint() if self.not_ is not None else None]
+
     def matches(self, other):
         """ Return True if other refers to the same schema based on 'self'. """
         return (('self' in self.links) and
@@ -552,6 +844,7 @@ class Schema(Entity):
 
 class Multi(Schema):
     _type = 'multi'
+    __slots__ = ()
 
     def __init__(self, parser, name, parent, **kwargs):
         super(Multi, self).__init__(Multi._type, parser, name, parent,
@@ -580,6 +873,7 @@ _register_type(Multi)
 
 
 class DynamicSchema(Schema):
+    __slots__ = ()
 
     def __init__(self, type, parser, name, parent, **kwargs):
         super(DynamicSchema, self).__init__(type, parser, name, parent,
@@ -603,8 +897,11 @@ class DynamicSchema(Schema):
         return self.refschema.toxml(input, parent)
 
     def __getitem__(self, name):
-        if name in self.__dict__:
-            return self.__dict__[name]
+        if name in _slot_names(type(self)):
+            try:
+                return object.__getattribute__(self, name)
+            except AttributeError:
+                pass
         return self.refschema.__getitem__(name)
 
     def __getattr__(self, name):
@@ -613,6 +910,10 @@ class DynamicSchema(Schema):
         # by the property 'reschema'
         if name == 'refschema' or name == '_refschema':
             raise AttributeError()
+        # Special methods probed by pickle and copy must not trigger
+        # resolution of the reference
+        if name.startswith('__'):
+            raise AttributeError(name)
         return getattr(self.refschema, name)
 
     def by_pointer(self, pointer):
@@ -624,6 +925,7 @@ class DynamicSchema(Schema):
 
 class Ref(DynamicSchema):
     _type = '$ref'
+    __slots__ = ('_refschema', '_refschema_id')
 
     def __init__(self, parser, name, parent, **kwargs):
         super(Ref, self).__init__(Ref._type, parser, name, parent, **kwargs)
@@ -636,15 +938,23 @@ class Ref(DynamicSchema):
             raise ParseError("$ref object may not have any other properties",
                              parser.input)
 
+    def _structure(self):
+        return [Ref._type, self._refschema_id]
+
+    def _find_refschema(self):
+        """Look up the target schema without caching or copying links."""
+        sch = self.servicedef.find_schema_by_id(self._refschema_id)
+        if sch is None:
+            sch = self.servicedef.find(self._refschema_id)
+        if sch is None:
+            raise InvalidReference(("%s $ref" % self.fullname()),
+                                   self._refschema_id)
+        return sch
+
     @property
     def refschema(self):
         if self._refschema is None:
-            sch = Schema.find_by_id(self._refschema_id)
-            if sch is None:
-                sch = self.servicedef.find(self._refschema_id)
-            if sch is None:
-                raise InvalidReference(("%s $ref" % self.fullname()),
-                                       self._refschema_id)
+            sch = self._find_refschema()
 
             self._refschema = sch
             for link in sch.links:
@@ -674,8 +984,11 @@ class Ref(DynamicSchema):
         return self.refschema.toxml(input, parent)
 
     def __getitem__(self, name):
-        if name in self.__dict__:
-            return self.__dict__[name]
+        if name in _slot_names(type(self)):
+            try:
+                return object.__getattribute__(self, name)
+            except AttributeError:
+                pass
         return self.refschema.__getitem__(name)
 
     def __getattr__(self, name):
@@ -684,6 +997,10 @@ class Ref(DynamicSchema):
         # by the property 'reschema'
         if name == 'refschema' or name == '_refschema':
             raise AttributeError()
+        # Special methods probed by pickle and copy must not trigger
+        # resolution of the reference
+        if name.startswith('__'):
+            raise AttributeError(name)
         return getattr(self.refschema, name)
 
     def by_pointer(self, pointer):
@@ -697,6 +1014,7 @@ _register_type(Ref)
 
 class Merge(DynamicSchema):
     _type = '$merge'
+    __slots__ = ('_mergesource', '_mergewith', '_refschema')
 
     def __init__(self, parser, name, parent, **kwargs):
         super(Merge, self).__init__(Merge._type, parser, name, parent,
@@ -711,11 +1029,14 @@ class Merge(DynamicSchema):
 
         self._refschema = None
 
+    def _structure(self):
+        return [Merge._type, self._mergesource, self._mergewith]
+
     @property
     def refschema(self):
         if self._refschema is None:
-            merged = json_merge_patch(self.servicedef,
-                                      self._mergesource, self._mergewith)
+            merged = merge(self.servicedef,
+                           self._mergesource, self._mergewith)
 
             self._refschema = Schema.parse(merged, name=self.name,
                                            servicedef=self.servicedef,
@@ -723,6 +1044,8 @@ class Merge(DynamicSchema):
             # Need to assign parent *after* assigning _refschema,
             # because otherwise we hit a recursion when doing some
             # logging that would try to resolve _refschema again...
+            # Keep the name computed without a parent.
+            self._refschema.fullname()
             self._refschema.parent = self
 
         return self._refschema
@@ -732,6 +1055,7 @@ _register_type(Merge)
 
 class Null(Schema):
     _type = 'null'
+    __slots__ = ()
 
     def __init__(self, parser, name, parent, **kwargs):
         super(Null, self).__init__(Null._type, parser, name, parent, **kwargs)
@@ -747,12 +1071,17 @@ _register_type(Null)
 
 class Boolean(Schema):
     _type = 'boolean'
+    __slots__ = ('_constraints',)
+
+    default = _constraint('default')
+    enum = _constraint('enum')
 
     def __init__(self, parser, name, parent, **kwargs):
         super(Boolean, self).__init__(Boolean._type, parser, name, parent,
                                       **kwargs)
-        parser.parse('default')
-        parser.parse('enum')
+        self._constraints = _Constraints.intern({
+            'default': parser.parse('default', save=False),
+            'enum': parser.parse('enum', save=False)})
 
     def validate(self, input):
         if (type(input) is not bool):
@@ -770,15 +1099,23 @@ _register_type(Boolean)
 
 class String(Schema):
     _type = 'string'
+    __slots__ = ('_constraints',)
+
+    minLength = _constraint('minLength')
+    maxLength = _constraint('maxLength')
+    pattern = _constraint('pattern')
+    enum = _constraint('enum')
+    default = _constraint('default')
 
     def __init__(self, parser, name, parent, **kwargs):
         super(String, self).__init__(String._type, parser, name, parent,
                                      **kwargs)
-        parser.parse('minLength', types=int)
-        parser.parse('maxLength', types=int)
-        parser.parse('pattern')
-        parser.parse('enum')
-        parser.parse('default')
+        self._constraints = _Constraints.intern({
+            'minLength': parser.parse('minLength', types=int, save=False),
+            'maxLength': parser.parse('maxLength', types=int, save=False),
+            'pattern': parser.parse('pattern', save=False),
+            'enum': parser.parse('enum', save=False),
+            'default': parser.parse('default', save=False)})
 
     def validate(self, input):
         def trunc():
@@ -801,7 +1138,8 @@ class String(Schema):
                 "%s: input must be no more than %d chars, got %d: %s" %
                 (self.fullname(), self.maxLength, len(input), trunc), self)
 
-        if (self.pattern is not None) and (not re.match(self.pattern, input)):
+        if ((self.pattern is not None) and
+                (not self._constraints.pattern.match(input))):
             raise ValidationError(
                 "%s: input failed pattern match %s: %s" %
                 (self.fullname(), self.pattern, trunc), self)
@@ -833,17 +1171,31 @@ _register_type(String)
 
 class NumberOrInteger(Schema):
     _type = 'number'
+    __slots__ = ('_constraints',)
+
+    allowed_types = _constraint('allowed_types')
+    minimum = _constraint('minimum')
+    maximum = _constraint('maximum')
+    exclusiveMinimum = _constraint('exclusiveMinimum')
+    exclusiveMaximum = _constraint('exclusiveMaximum')
+    default = _constraint('default')
+    enum = _constraint('enum')
 
     def __init__(self, type, allowed_types, parser, name, parent, **kwargs):
         super(NumberOrInteger, self).__init__(type, parser,
                                               name, parent, **kwargs)
-        self.allowed_types = allowed_types
-        parser.parse('minimum', types=allowed_types)
-        parser.parse('maximum', types=allowed_types)
-        parser.parse('exclusiveMinimum', False, types=bool)
-        parser.parse('exclusiveMaximum', False, types=bool)
-        parser.parse('default', types=allowed_types)
-        parser.parse('enum', types=list)
+
+        def parse(prop, default_value=None, types=allowed_types):
+            return parser.parse(prop, default_value, types=types, save=False)
+
+        self._constraints = _Constraints.intern({
+            'allowed_types': allowed_types,
+            'minimum': parse('minimum'),
+            'maximum': parse('maximum'),
+            'exclusiveMinimum': parse('exclusiveMinimum', False, bool),
+            'exclusiveMaximum': parse('exclusiveMaximum', False, bool),
+            'default': parse('default'),
+            'enum': parse('enum', types=list)})
 
     def validate(self, input):
         if (not any(isinstance(input, t) for t in self.allowed_types) or
@@ -899,6 +1251,7 @@ class NumberOrInteger(Schema):
 
 class Number(NumberOrInteger):
     _type = 'number'
+    __slots__ = ()
 
     def __init__(self, parser, name, parent, **kwargs):
         super(Number, self).__init__(self._type, (int, float, int), parser,
@@ -909,6 +1262,7 @@ _register_type(Number)
 
 class Integer(NumberOrInteger):
     _type = 'integer'
+    __slots__ = ()
 
     def __init__(self, parser, name, parent, **kwargs):
         super(Integer, self).__init__(self._type, (int, int), parser,
@@ -919,6 +1273,7 @@ _register_type(Integer)
 
 class Timestamp(Schema):
     _type = 'timestamp'
+    __slots__ = ()
 
     def __init__(self, parser, name, parent, **kwargs):
         super(Timestamp, self).__init__(Timestamp._type, parser, name, parent,
@@ -936,6 +1291,7 @@ _register_type(Timestamp)
 
 class TimestampHP(Schema):
     _type = 'timestamp-hp'
+    __slots__ = ()
 
     def __init__(self, parser, name, parent, **kwargs):
         super(TimestampHP, self).__init__(TimestampHP._type, parser,
@@ -953,6 +1309,9 @@ _register_type(TimestampHP)
 
 class Object(Schema):
     _type = 'object'
+    __slots__ = ('properties', 'additional_properties', '_constraints')
+
+    required = _constraint('required')
 
     def __init__(self, parser, name, parent, **kwargs):
         super(Object, self).__init__(Object._type, parser, name, parent,
@@ -966,7 +1325,8 @@ class Object(Schema):
             self.properties[prop] = c
             self.children.append(c)
 
-        parser.parse('required', types=[list])
+        self._constraints = _Constraints.intern({
+            'required': parser.parse('required', types=[list], save=False)})
 
         ap = parser.parse('additionalProperties',
                           types=[dict, bool], save=False)
@@ -981,6 +1341,13 @@ class Object(Schema):
             self.additional_properties = c
             self.children.append(c)
 
+    def _structure(self):
+        ap = self.additional_properties
+        return (super(Object, self)._structure() +
+                [dict((k, v.fingerprint())
+                      for k, v in self.properties.items()),
+                 ap.fingerprint() if isinstance(ap, Schema) else ap])
+
     def __getitem__(self, name):
         if name in self.properties:
             return self.properties[name]
@@ -1054,6 +1421,10 @@ _register_type(Object)
 
 class Array(Schema):
     _type = 'array'
+    __slots__ = ('items', '_constraints')
+
+    minItems = _constraint('minItems')
+    maxItems = _constraint('maxItems')
 
     def __init__(self, parser, name, parent, **kwargs):
         super(Array, self).__init__(Array._type, parser, name, parent,
@@ -1068,8 +1439,12 @@ class Array(Schema):
                                   id='%s/items' % self.id)
         self.children.append(self.items)
 
-        parser.parse('minItems')
-        parser.parse('maxItems')
+        self._constraints = _Constraints.intern({
+            'minItems': parser.parse('minItems', save=False),
+            'maxItems': parser.parse('maxItems', save=False)})
+
+    def _structure(self):
+        return super(Array, self)._structure() + [self.items.fingerprint()]
 
     def is_simple(self):
         return False
@@ -1127,12 +1502,13 @@ _register_type(Array)
 
 class Data(Schema):
     _type = 'data'
+    __slots__ = ('content_type',)
 
     def __init__(self, parser, name, parent, **kwargs):
         super(Data, self).__init__(Data._type, parser, name, parent, **kwargs)
 
         parser.parse('content_type', required=True)
-        parser.parse('description')
+        parser.parse('description', doc=True)
 
     def validate(self, input):
         # any value will pass, regardless of content_type set
@@ -1145,6 +1521,11 @@ _register_type(Data)
 
 
 class Relation(Entity):
+    __slots__ = ('schema', 'vars', '_resource', '_resource_id',
+                 '_description', '_tags')
+
+    description = _doc_field('description')
+    tags = _doc_field('tags')
 
     def __init__(self, input, name, schema, id):
         super(Relation, self).__init__(id=id, name=name, parent=schema,
@@ -1152,14 +1533,14 @@ class Relation(Entity):
         self.schema = schema
         self.vars = None
 
-        with Parser(input, self.fullname(), self) as parser:
+        with Parser(input, None, self) as parser:
             # Lazy resolution because references may be used before they
             # are defined
             self._resource = None
             parser.parse('resource', required=True, save_as='_resource_id')
             parser.parse('vars')
-            parser.parse('description', '')
-            parser.parse('tags', {}, types=dict)
+            parser.parse('description', '', doc=True)
+            parser.parse('tags', {}, types=dict, doc=True)
 
     def __str__(self):
         return self.name
@@ -1173,7 +1554,7 @@ class Relation(Entity):
     @property
     def resource(self):
         if self._resource is None:
-            sch = Schema.find_by_id(self._resource_id)
+            sch = self.servicedef.find_schema_by_id(self._resource_id)
             if sch is None:
                 sch = self.servicedef.find(self._resource_id)
             if sch is None:
@@ -1239,19 +1620,26 @@ class Relation(Entity):
 
 
 class Link(Entity):
+    __slots__ = ('schema', '_description', '_notes', '_example', 'method',
+                 'authorization', '_tags', 'path', '_request', '_response')
+
+    description = _doc_field('description')
+    notes = _doc_field('notes')
+    example = _doc_field('example')
+    tags = _doc_field('tags')
 
     def __init__(self, input, name, schema, id):
         super(Link, self).__init__(id=id, name=name, parent=schema,
                                    intermediary='links')
         self.schema = schema
 
-        with Parser(input, self.fullname(), self) as parser:
-            parser.parse('description', '')
-            parser.parse('notes', '')
-            parser.parse('example')
+        with Parser(input, None, self) as parser:
+            parser.parse('description', '', doc=True)
+            parser.parse('notes', '', doc=True)
+            parser.parse('example', doc=True)
             parser.parse('method')
             parser.parse('authorization')
-            parser.parse('tags', {}, types=dict)
+            parser.parse('tags', {}, types=dict, doc=True)
 
             pathdef = parser.parse('path', save=False)
             if pathdef is not None:
@@ -1359,6 +1747,7 @@ class Path(Entity):
     data structure relative to the place where the link was defined.
 
     """
+    __slots__ = ('link', 'pathdef', 'vars', 'var_schemas', 'template')
 
     def __init__(self, link, pathdef, additional_vars=None):
         """Create a `Path` associated with `link`."""
@@ -1374,7 +1763,8 @@ class Path(Entity):
 
         if isinstance(pathdef, dict):
             self.template = pathdef['template']
-            self.vars = pathdef['vars']
+            # Copy, vars are added and replaced below
+            self.vars = dict(pathdef['vars'])
         else:
             self.template = pathdef
             self.vars = {}
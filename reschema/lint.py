@@ -11,6 +11,7 @@ import traceback
 import reschema.exceptions
 import reschema.settings
 from reschema import jsonschema
+from reschema.loader_nodes import has_marks, get_marks
 
 INDENT_OFFSET = 4
 
@@ -25,10 +26,23 @@ def get_first_marked_object(*objects):
 
     """
     for obj in objects:
-        if hasattr(obj, "start_mark"):
+        if has_marks(obj):
             return obj
 
 
+def get_input_item(items, value):
+    """ Return the item of the raw input list `items` equal to value.
+
+    Schema attributes hold plain copies of the input, use this to get
+    the original, marked item.  Returns value if not found.
+
+    """
+    for item in items or ():
+        if item == value:
+            return item
+    return value
+
+
 class ValidationFail(reschema.exceptions.MarkedError):
     """
     Schema did something it shouldn't have
@@ -513,15 +527,15 @@ def required_property_with_default_value(schema):
     if hasattr(schema, 'required') and schema.required:
         for required_prop in schema.required:
             if required_prop in schema.properties:
-                default = getattr(schema.properties[required_prop], 'default',
-                                  None)
+                prop = schema.properties[required_prop]
+                default = getattr(prop, 'default', None)
                 if default is not None:
                     raise ValidationFail(
                         "A required property '{0}' should not have a default "
                         "value in '{1}'".format(
                             required_prop, schema.fullname()
                         ),
-                        default)
+                        prop.input.get('default', default))
 
 
 @Validator.schema('C0001')
@@ -746,7 +760,9 @@ def required_is_valid(schema):
                 if k not in schema.properties:
                     raise ValidationFail("Required field '{0}' is not"
                                          " defined in '{1}'"
-                                         .format(k, schema.fullname()), k)
+                                         .format(k, schema.fullname()),
+                                         get_input_item(
+                                             schema.input.get('required'), k))
 
 
 @Validator.schema('E0003')
@@ -787,9 +803,9 @@ def self_link_is_first(resource):
     if 'self' not in resource.links:
         return
 
-    self_mark = resource.links['self'].name.start_mark
+    self_mark, _ = get_marks(resource.links['self'].name)
     for link in list(resource.links.values()):
-        mark = link.name.start_mark
+        mark, _ = get_marks(link.name)
         if link.name == "self":
             continue
         if (mark.line, mark.column) < (self_mark.line, self_mark.column):
@@ -4,11 +4,180 @@
 # accompanying the software ("License").  This software is distributed "AS IS"
 # as set forth in the License.
 
+"""
+Support for marks, the source locations of loaded data.
+
+Marks are kept in one of two ways:
+
+ - By default, marked loaders return dict_node/list_node/str_node
+   instances, subclasses of the builtin types that carry `start_mark`
+   and `end_mark` attributes.
+
+ - In compact mode (see `reschema.settings.COMPACT_MARKS`), loaders
+   return plain builtin objects and record `(start, end)` character
+   offsets in a `MarkTable`, keyed by node identity.  Line and column
+   are only computed when a mark is actually requested.
+
+Code that consumes marks should use `has_marks()`, `get_marks()` and
+`copy_marks()`, which handle both.
+"""
+
+import re
+import weakref
+from bisect import bisect_left
+
 from yaml.error import Mark
 
+# All live MarkTable instances, consulted for nodes without mark attributes
+_mark_tables = weakref.WeakSet()
+
+NEWLINE = re.compile('\n')
+
+
+class MarkTable(object):
+    """Side table of compact marks for one loaded document.
+
+    :param name: name of the source, used for `Mark.name`
+    :param buffer: the full source text the offsets refer to
+
+    The table holds a reference to every node it marks, this keeps
+    node ids unique for as long as the table is alive.  Note that
+    CPython shares some small strings (such as single characters), such
+    strings end up with the marks of their last occurrence.
+    """
+
+    def __init__(self, name, buffer):
+        self.name = name
+        self.buffer = buffer
+        self._offsets = {}
+        self._nodes = []
+        self._newlines = None
+        self._key_nodes = {}
+        _mark_tables.add(self)
+
+    def add(self, node, start, end):
+        """Record `start` / `end` offsets for `node`."""
+        if id(node) not in self._offsets:
+            self._nodes.append(node)
+        self._offsets[id(node)] = (start, end)
+
+    def offsets(self, node):
+        """Return the `(start, end)` offsets for node or None."""
+        return self._offsets.get(id(node))
+
+    def key_nodes(self, obj):
+        """Return a map of each key of dict obj to itself."""
+        keys = _key_map(self._key_nodes.get(id(obj)), obj)
+        self._key_nodes[id(obj)] = keys
+        return keys
+
+    def linecol(self, index):
+        """Return the `(line, column)` of a character offset."""
+        if self._newlines is None:
+            self._newlines = [m.start() for m in
+                              NEWLINE.finditer(self.buffer)]
+        line = bisect_left(self._newlines, index)
+        if line == 0:
+            column = index
+        else:
+            column = index - self._newlines[line - 1] - 1
+        return line, column
+
+    def mark(self, index):
+        """Return a full Mark for a character offset."""
+        line, column = self.linecol(index)
+        return Mark(self.name, index, line, column, self.buffer, index)
+
+    def marks(self, node):
+        """Return `(start_mark, end_mark)` for node or None."""
+        offsets = self._offsets.get(id(node))
+        if offsets is None:
+            return None
+        return self.mark(offsets[0]), self.mark(offsets[1])
+
+
+class SourceSpan(object):
+    """Character offsets `start` / `end` of a value in its source."""
+    __slots__ = ('start', 'end')
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return 'SourceSpan(%d, %d)' % (self.start, self.end)
+
+
+def _find_table(obj):
+    for table in list(_mark_tables):
+        if id(obj) in table._offsets:
+            return table
+    return None
+
+
+def has_marks(obj):
+    """Return True if marks are known for obj."""
+    if hasattr(obj, 'start_mark'):
+        return True
+    return bool(_mark_tables) and _find_table(obj) is not None
+
+
+def get_marks(obj):
+    """Return `(start_mark, end_mark)` for obj, or `(None, None)`."""
+    if hasattr(obj, 'start_mark'):
+        return obj.start_mark, obj.end_mark
+    if _mark_tables:
+        table = _find_table(obj)
+        if table is not None:
+            return table.marks(obj)
+    return None, None
+
+
+def copy_marks(src, dst):
+    """Associate the marks of src, if any, with dst."""
+    if hasattr(src, 'start_mark'):
+        dst.start_mark = src.start_mark
+        dst.end_mark = src.end_mark
+    elif _mark_tables:
+        table = _find_table(src)
+        if table is not None:
+            table.add(dst, *table.offsets(src))
+
+
+def _key_map(keys, obj):
+    if keys is None or len(keys) != len(obj):
+        keys = {k: k for k in obj}
+    return keys
+
+
 def obj_key_node(obj, prop):
-    idx = list(obj.keys()).index(prop)
-    return list(obj.keys())[idx]
+    """Return the key of dict `obj` equal to `prop`, or None if missing.
+
+    The key returned is the original key object, i.e., the one carrying
+    marks.  The key-to-key map is built once per object (cached on the
+    dict_node or in its MarkTable) so each lookup is O(1).
+    """
+    if prop not in obj:
+        return None
+
+    if isinstance(obj, dict_node):
+        keys = obj._key_nodes = _key_map(obj.__dict__.get('_key_nodes'), obj)
+    else:
+        table = _find_table(obj) if _mark_tables else None
+        if table is None:
+            return prop
+        keys = table.key_nodes(obj)
+
+    key = keys.get(prop)
+    if key is None:
+        # Keys changed without changing the length, rebuild
+        keys = {k: k for k in obj}
+        if isinstance(obj, dict_node):
+            obj._key_nodes = keys
+        else:
+            table._key_nodes[id(obj)] = keys
+        key = keys[prop]
+    return key
 
 
 def add_marks_to_node(obj, start_mark=None, end_mark=None):
@@ -31,6 +200,7 @@ def create_str_node_class(cls):
         def __new__(self, x=None, start_mark=None, end_mark=None):
             return cls.__new__(self, x)
     node_class.__name__ = '%s_node' % cls.__name__
+    node_class.__qualname__ = node_class.__name__
     return node_class
 
 
@@ -43,6 +213,7 @@ def create_mutable_node_class(cls):
         def __new__(self, x=None, start_mark=None, end_mark=None):
             return cls.__new__(self, x)
     node_class.__name__ = '%s_node' % cls.__name__
+    node_class.__qualname__ = node_class.__name__
     return node_class
 
 
@@ -0,0 +1,345 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+"""
+This module implements load hooks for `ServiceDefManager`.
+
+`DirectoryLoadHook` finds service definition files in a directory tree:
+
+.. code-block:: python
+
+   >>> manager = ServiceDefManager()
+   >>> manager.add_load_hook(DirectoryLoadHook('/path/to/servicedefs'))
+   >>> bookstore_def = manager.find_by_name('bookstore', '1.0')
+
+Files are indexed by the 'id', 'name', 'version' and 'provider' in
+their header, i.e. the top level keys at the start of the file, so only
+the header is parsed when indexing.  The index may be kept in a file
+to be reused by later instances, only new or modified files are read
+again.
+"""
+
+import os
+import re
+import json
+import logging
+import tempfile
+import threading
+from json.decoder import WHITESPACE, scanstring
+
+import yaml
+
+from reschema import yaml_loader, binary_loader
+from reschema.servicedef import ServiceDef, ServiceDefLoadHook
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of the index file changes
+INDEX_FORMAT = 1
+
+HEADER_KEYS = ('id', 'name', 'version', 'provider')
+
+FORMATS = {'.json': 'json', '.yml': 'yaml', '.yaml': 'yaml',
+           '.rsb': 'binary'}
+
+YAML_HEADER_KEY = re.compile(r'''^(["']?)(%s)\1[ \t]*:(.*)$''' %
+                             '|'.join(HEADER_KEYS))
+
+
+class _Incomplete(Exception):
+    """More of the document is needed to read the header."""
+
+
+def _json_header(text, complete):
+    header = {}
+    decoder = json.JSONDecoder()
+    ws = WHITESPACE.match
+    try:
+        idx = ws(text, 0).end()
+        if text[idx:idx + 1] != '{':
+            raise ValueError('not a JSON object')
+        idx = ws(text, idx + 1).end()
+        while len(header) < len(HEADER_KEYS) and text[idx:idx + 1] == '"':
+            key, idx = scanstring(text, idx + 1)
+            idx = ws(text, idx).end()
+            if text[idx:idx + 1] != ':':
+                raise ValueError("expecting ':'")
+            value, idx = decoder.raw_decode(text, ws(text, idx + 1).end())
+            if idx == len(text) and not complete:
+                # A number may be cut short
+                raise _Incomplete()
+            if key in HEADER_KEYS:
+                header[key] = value
+            idx = ws(text, idx).end()
+            if text[idx:idx + 1] == ',':
+                idx = ws(text, idx + 1).end()
+    except (ValueError, IndexError):
+        if not complete:
+            raise _Incomplete()
+        raise
+    if len(header) < len(HEADER_KEYS) and not complete:
+        raise _Incomplete()
+    return header
+
+
+def _yaml_header(text, complete):
+    lines = text.split('\n')
+    if not complete:
+        # The last line may be cut short
+        lines.pop()
+
+    header = {}
+    for line in lines:
+        m = YAML_HEADER_KEY.match(line)
+        if m is None:
+            continue
+        value = yaml.safe_load(m.group(3))
+        if value is None:
+            # Not a scalar on the same line
+            raise ValueError('unsupported header value: %s' % line)
+        header[m.group(2)] = value
+        if len(header) == len(HEADER_KEYS):
+            return header
+
+    if not complete:
+        raise _Incomplete()
+    return header
+
+
+def read_header(filename):
+    """ Return the header of the servicedef file `filename`.
+
+    Only as much of the file as needed is read and parsed.  If the
+    header can't be found that way, for instance in binary files, the
+    whole file is loaded.
+
+    :return: dict with the keys in HEADER_KEYS found in the file
+
+    """
+    format = FORMATS[os.path.splitext(filename)[1]]
+    if format != 'binary':
+        scan = _json_header if format == 'json' else _yaml_header
+        try:
+            with open(filename, 'r') as f:
+                text = ''
+                size = 4096
+                while True:
+                    chunk = f.read(size)
+                    text += chunk
+                    try:
+                        header = scan(text, complete=not chunk)
+                        break
+                    except _Incomplete:
+                        size *= 2
+            if len(header) == len(HEADER_KEYS):
+                return header
+        except ValueError:
+            pass
+
+    # Fall back to loading everything
+    with open(filename, 'rb' if format == 'binary' else 'r') as f:
+        if format == 'binary':
+            obj = binary_loader.ordered_load(f)
+        elif format == 'json':
+            obj = json.load(f)
+        else:
+            obj = yaml_loader.ordered_load(f)
+    return dict((k, obj[k]) for k in HEADER_KEYS
+                if isinstance(obj, dict) and k in obj)
+
+
+class DirectoryLoadHook(ServiceDefLoadHook):
+    """ Load hook for the servicedef files in a directory tree.
+
+    Lookups use an index of the files by id and by name, built from
+    the header of each '*.json', '*.yaml', '*.yml' and '*.rsb' file.
+    The index is checked against the size and modification time of
+    the files when first used.  It is checked again when a lookup finds
+    a modified file, or misses after a directory in the tree was
+    modified, i.e. files were added, removed or renamed.  Call
+    `refresh()` to pick up other files whose header was edited in place.
+
+    :param directory: root of the directory tree
+
+    :param index_file: if given, the index is saved to and loaded
+        from this file, so files are only read again when modified
+
+    :param kwargs: passed to `ServiceDef` for loaded files, such as
+        `lazy=True`
+
+    """
+
+    def __init__(self, directory, index_file=None, **kwargs):
+        self.directory = os.path.abspath(directory)
+        self.index_file = index_file and os.path.abspath(index_file)
+        self.servicedef_kwargs = kwargs
+
+        # Map of path relative to directory to the file's size, mtime
+        # and header
+        self.files = None
+        # Map of directory to its mtime when last scanned
+        self.dirs = {}
+        self.by_id = {}
+        self.by_name = {}
+        self._lock = threading.Lock()
+
+    def find_by_id(self, id_):
+        path = self._find(self.by_id, id_)
+        return self._load(path) if path else None
+
+    def find_by_name(self, name, version, provider):
+        path = self._find(self.by_name, (name, version, provider))
+        return self._load(path) if path else None
+
+    def _find(self, index, key):
+        with self._lock:
+            if self.files is None:
+                self._read_index()
+                self._refresh()
+            path = index.get(key)
+            if path is None:
+                stale = self._dirs_modified()
+            else:
+                stale = not self._is_current(path)
+            if stale:
+                self._refresh()
+                path = index.get(key)
+            return path
+
+    def _load(self, path):
+        servicedef = ServiceDef(**self.servicedef_kwargs)
+        servicedef.load(os.path.join(self.directory, path))
+        return servicedef
+
+    def refresh(self):
+        """ Update the index for new, modified and removed files. """
+        with self._lock:
+            if self.files is None:
+                self._read_index()
+            self._refresh()
+
+    def _is_current(self, path):
+        entry = self.files[path]
+        try:
+            st = os.stat(os.path.join(self.directory, path))
+        except OSError:
+            return False
+        return (entry['size'], entry['mtime']) == (st.st_size,
+                                                   st.st_mtime_ns)
+
+    def _dirs_modified(self):
+        for dirname, mtime in self.dirs.items():
+            try:
+                if os.stat(dirname).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def _walk(self, dirs):
+        """ Yield the servicedef files in the tree, in sorted order.
+
+        Like `os.walk()`, but records the mtime of each directory in
+        `dirs` before listing it, so later changes are noticed.
+
+        """
+        stack = [self.directory]
+        while stack:
+            root = stack.pop()
+            try:
+                dirs[root] = os.stat(root).st_mtime_ns
+                entries = sorted(os.scandir(root), key=lambda e: e.name)
+            except OSError:
+                continue
+            subdirs = []
+            for entry in entries:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        subdirs.append(entry.path)
+                elif os.path.splitext(entry.name)[1] in FORMATS:
+                    yield entry.path
+            stack.extend(reversed(subdirs))
+
+    def _refresh(self):
+        files = {}
+        dirs = {}
+        changed = False
+        for filename in self._walk(dirs):
+            if filename == self.index_file:
+                continue
+            path = os.path.relpath(filename, self.directory)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            entry = self.files.get(path)
+            if (  entry is None or entry['size'] != st.st_size or
+                  entry['mtime'] != st.st_mtime_ns):
+                changed = True
+                try:
+                    header = read_header(filename)
+                except Exception as e:
+                    logger.warning("Ignoring unreadable servicedef "
+                                   "file %s: %s" % (filename, e))
+                    header = {}
+                entry = dict(header, size=st.st_size,
+                             mtime=st.st_mtime_ns)
+            files[path] = entry
+
+        changed = changed or len(files) != len(self.files)
+        self.files = files
+        self.dirs = dirs
+        self._build()
+        if changed and self.index_file:
+            self._write_index()
+
+    def _build(self):
+        # Updated in place, _find() holds on to them
+        self.by_id.clear()
+        self.by_name.clear()
+        for path, entry in self.files.items():
+            if not all(k in entry for k in HEADER_KEYS):
+                continue
+            id_ = entry['id']
+            if id_ in self.by_id:
+                logger.warning("Ignoring %s, id %s is already defined in %s" %
+                               (path, id_, self.by_id[id_]))
+                continue
+            self.by_id[id_] = path
+            self.by_name[(entry['name'], entry['version'],
+                          entry['provider'])] = path
+
+    def _read_index(self):
+        self.files = {}
+        if not self.index_file:
+            return
+        try:
+            with open(self.index_file, 'r') as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception:
+            logger.warning("Ignoring unreadable index file: %s" %
+                           self.index_file, exc_info=True)
+            return
+        if (  index.get('format') == INDEX_FORMAT and
+              index.get('directory') == self.directory):
+            self.files = index['files']
+
+    def _write_index(self):
+        index = {'format': INDEX_FORMAT, 'directory': self.directory,
+                 'files': self.files}
+        directory = os.path.dirname(os.path.abspath(self.index_file))
+        fd, tmpname = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmpname, self.index_file)
+        except Exception:
+            logger.warning("Failed to write index file %s" %
+                           self.index_file, exc_info=True)
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
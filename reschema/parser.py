@@ -4,12 +4,14 @@
 # accompanying the software ("License").  This software is distributed "AS IS"
 # as set forth in the License.
 
+import copy
 import urllib.parse
 
 from reschema.exceptions import ParseError, InvalidReference
 from reschema.util import check_type
 
-from reschema.loader_nodes import obj_key_node
+from reschema.loader_nodes import (obj_key_node, has_marks, copy_marks,
+                                   get_marks, SourceSpan)
 
 import reschema.settings
 
@@ -34,7 +36,8 @@ class Parser(object):
     input dictionary keys have been consumed upon exit.
 
     :param dict input: input to parser
-    :param name: name for logging / error
+    :param name: name for logging / error, if None the `fullname()` of
+        obj is used
     :param obj: object on which to set attributes (i.e. the "context")
 
     If obj is None, it may be set later with set_context(), but
@@ -45,6 +48,8 @@ class Parser(object):
         #       longer actually used in this class.
 
         if not isinstance(input, dict):
+            if name is None and obj is not None:
+                name = obj.fullname()
             raise ParseError('%s: definition should be a dictionary, got: %s' %
                              (name, type(input)), input)
 
@@ -56,6 +61,19 @@ class Parser(object):
         if obj:
             self.set_context(name, obj)
 
+    @property
+    def name(self):
+        """Name for logging / errors."""
+        if self._name is None and self.obj is not None:
+            fullname = getattr(self.obj, 'fullname', None)
+            if fullname is not None:
+                return fullname()
+        return self._name
+
+    @name.setter
+    def name(self, value):
+        self._name = value
+
     def __enter__(self):
         return self
 
@@ -103,7 +121,7 @@ class Parser(object):
         """
 
         # If object aleady is marked, short circuit.
-        if hasattr(obj, "start_mark"):
+        if has_marks(obj):
             return
 
         if prop is None:
@@ -118,12 +136,10 @@ class Parser(object):
             if not as_key:
                 val = self.input[val]
 
-        if hasattr(val, "start_mark"):
-            obj.start_mark = val.start_mark
-            obj.end_mark = val.end_mark
+        copy_marks(val, obj)
 
     def parse(self, prop, default_value=None, required=False,
-              types=None, save=True, save_as=None):
+              types=None, save=True, save_as=None, doc=False):
         """Parse a key from the input dict.
 
         :param string prop: Property name to extract
@@ -144,6 +160,10 @@ class Parser(object):
         :param str save_as: the property name to save as, defaults
             to ``prop``
 
+        :param doc: If true, this is a documentation-only property.  For
+            a lean servicedef (see `ServiceDef.lean`), a SourceSpan of
+            the value is returned instead of the value, if known.
+
         :raises reschema.exceptions.ParseError: if the type of the
             data is incorrect or if the property is required but
             missing.
@@ -151,10 +171,14 @@ class Parser(object):
         :return: The parsed value.
         """
 
-        if (prop == 'description' and not reschema.settings.LOAD_DESCRIPTIONS):
+        lean = doc and self.lean_source() is not None
+
+        if (prop == 'description' and not lean and
+                not reschema.settings.LOAD_DESCRIPTIONS):
             val = ''
             if prop in self.input:
-                del(self.input[prop])
+                if not self.readonly_input():
+                    del(self.input[prop])
                 self.parsed_props.add(prop)
 
         elif prop in self.input:
@@ -162,6 +186,10 @@ class Parser(object):
             if types:
                 check_type(prop, val, types, self.input)
             self.parsed_props.add(prop)
+            if lean:
+                start_mark, end_mark = get_marks(val)
+                if start_mark is not None:
+                    val = SourceSpan(start_mark.index, end_mark.index)
 
         elif required:
             raise ParseError(
@@ -178,6 +206,17 @@ class Parser(object):
 
         return val
 
+    def lean_source(self):
+        """Return the `lean_source` of the context's servicedef."""
+        servicedef = getattr(self.obj, 'servicedef', self.obj)
+        return getattr(servicedef, 'lean_source', None)
+
+    def readonly_input(self):
+        """Return True if the input of the context's servicedef must not
+        be modified."""
+        servicedef = getattr(self.obj, 'servicedef', self.obj)
+        return getattr(servicedef, 'readonly_input', False)
+
     def check_input(self):
         """ Verify that all input properities were parsed. """
         if input is None:
@@ -227,31 +266,125 @@ class Parser(object):
         # urljoin will take care of the rest
         return urllib.parse.urljoin(base_id, ref)
 
-    def preprocess_input(self, base_id):
-        """Perform some preprocessing on our input."""
-        self.preprocess(base_id, self.input)
+    def preprocess_input(self, base_id, readonly=False):
+        """Perform some preprocessing on our input.
+
+        If `readonly` is True, the input is left unmodified and
+        `self.input` is replaced by the preprocessed copy.
+
+        :return: the set of absolute references found in the input
+
+        """
+        if readonly:
+            refs = set()
+            self.input = self.preprocessed(base_id, self.input, refs)
+            return refs
+        return self.preprocess(base_id, self.input)
 
     @classmethod
     def preprocess(cls, base_id, input):
-        """Perform preprocessing on the supplied input."""
-        cls.expand_refs(base_id, input)
+        """Perform preprocessing on the supplied input.
+
+        Returns the set of absolute references found in input.
+        """
+        return cls.expand_refs(base_id, input)
+
+    @classmethod
+    def preprocessed(cls, base_id, input, refs=None):
+        """Return a preprocessed version of input without modifying it.
+
+        If given, the absolute references found are added to `refs`.
+        """
+        return cls.expanded_refs(base_id, input, refs)
 
     @classmethod
     def expand_refs(cls, base_id, input):
-        """ Replace all relative refs in input with absolute refs"""
+        """ Replace all relative refs in input with absolute refs
+
+        The input is walked iteratively, and each distinct reference
+        is only expanded once per call.  Returns the set of absolute
+        references.
 
-        if input:
-            if isinstance(input, dict):
-                if '$ref' in input and isinstance(input['$ref'], str):
+        """
+        expanded = {}
+        stack = [input]
+        while stack:
+            obj = stack.pop()
+            if isinstance(obj, dict):
+                ref = obj.get('$ref')
+                if isinstance(ref, str):
                     # replace relative refs with fully expanded refs
-                    oldref = input['$ref']
-                    newref = cls.expand_ref(base_id, oldref)
-                    input['$ref'] = newref
+                    newref = expanded.get(ref)
+                    if newref is None:
+                        newref = cls.expand_ref(base_id, ref)
+                        expanded[ref] = newref
+                    obj['$ref'] = newref
+                else:
+                    stack.extend(obj.values())
 
-                elif len(list(input.keys())) > 0:
-                    for k, v in input.items():
-                        cls.expand_refs(base_id, v)
+            elif isinstance(obj, list):
+                stack.extend(obj)
 
-            elif isinstance(input, list):
-                for v in input:
-                    cls.expand_refs(base_id, v)
+        return set(expanded.values())
+
+    @classmethod
+    def expanded_refs(cls, base_id, input, refs=None):
+        """ Return input with all relative refs replaced by absolute refs
+
+        The input is not modified.  Only dicts and lists that contain
+        (directly or further down) a reference that changes are copied,
+        everything else is shared with input.
+
+        If given, the absolute references are added to the set `refs`.
+
+        """
+        expanded = {}
+
+        # Dicts and lists of input, each after the one containing it
+        nodes = []
+        stack = [input]
+        while stack:
+            obj = stack.pop()
+            if isinstance(obj, dict):
+                nodes.append(obj)
+                if not isinstance(obj.get('$ref'), str):
+                    stack.extend(obj.values())
+            elif isinstance(obj, list):
+                nodes.append(obj)
+                stack.extend(obj)
+
+        # Copies of the nodes that changed, by id, children first
+        copies = {}
+        for obj in reversed(nodes):
+            result = None
+            if isinstance(obj, dict):
+                ref = obj.get('$ref')
+                if isinstance(ref, str):
+                    newref = expanded.get(ref)
+                    if newref is None:
+                        newref = cls.expand_ref(base_id, ref)
+                        expanded[ref] = newref
+                    if newref != ref:
+                        result = copy.copy(obj)
+                        copy_marks(obj, result)
+                        result['$ref'] = newref
+                    items = ()
+                else:
+                    items = obj.items()
+            else:
+                items = enumerate(obj)
+
+            for k, v in items:
+                newv = copies.get(id(v))
+                if newv is not None:
+                    if result is None:
+                        result = copy.copy(obj)
+                        copy_marks(obj, result)
+                    result[k] = newv
+            if result is not None:
+                copies[id(obj)] = result
+
+        result = copies.get(id(input), input)
+        if refs is not None:
+            refs.update(expanded.values())
+        return result
@@ -59,24 +59,37 @@ service definition.
 """
 
 # System imports
+import os
 import urllib.parse
 import json
+import sys
+import hashlib
+import weakref
 from io import StringIO
 from collections import OrderedDict
+from collections.abc import Mapping
+import asyncio
 import logging
+import time
+import threading
 import traceback
+from concurrent.futures import (ThreadPoolExecutor, Future, wait,
+                                FIRST_COMPLETED)
 
-from jsonpointer import JsonPointer
+from jsonpointer import JsonPointer, resolve_pointer, JsonPointerException
 
 # Local imports
 import reschema.jsonschema as jsonschema
 from reschema.jsonschema import Schema
 from reschema.parser import Parser
-from reschema import yaml_loader, json_loader
+from reschema import yaml_loader, json_loader, binary_loader
+from reschema.cache import ServiceDefCache
+from reschema.util import canonical_json
 from reschema.exceptions import (ParseError, UnsupportedSchema, NoManager,
                                  InvalidReference, DuplicateServiceId,
                                  InvalidServiceId, InvalidServiceName,
-                                 ReschemaLoadHookException)
+                                 ReschemaLoadHookException,
+                                 ReschemaException, UnsupportedUpdate)
 import reschema.settings
 
 __all__ = ['ServiceDef']
@@ -89,6 +102,38 @@ SUPPORTED_SCHEMAS = frozenset([
 """ The set of schema versions understood by this version of reschema """
 
 
+def _file_format(filename):
+    """Return the format of a servicedef file from its extension."""
+    if filename.endswith('.json'):
+        return 'json'
+    elif filename.endswith(('.yml', '.yaml')):
+        return 'yaml'
+    elif filename.endswith('.rsb'):
+        return 'binary'
+    raise ValueError(
+        "Unrecognized file extension, use '*.json', '*.yaml' "
+        "or '*.rsb': %s" % filename)
+
+
+def _file_stat(filename):
+    st = os.stat(filename)
+    return (st.st_size, st.st_mtime_ns)
+
+
+def _input_digests(obj):
+    """Return digests of the input of each type and resource in obj.
+
+    :return: dict of (section, name) to digest
+
+    """
+    digests = {}
+    for section in ('types', 'resources'):
+        for name, input_ in (obj.get(section) or {}).items():
+            digests[(section, name)] = hashlib.sha256(
+                canonical_json(input_).encode('utf-8')).digest()
+    return digests
+
+
 class ServiceDefLoadHook(object):
     """ Interface for load hooks.
 
@@ -124,16 +169,75 @@ class ServiceDefManager(object):
     instances by id as indicated in the 'id' property
     at the top level of the schema.
 
+    A manager may be used from several threads.  When several threads
+    look up the same unknown id or name, only one runs the load hooks
+    and the others wait for its result.
+
+    :param negative_cache_ttl: seconds to remember ids and names that
+        could not be loaded, further lookups then fail without running
+        the hooks again.  Defaults to
+        `reschema.settings.NEGATIVE_CACHE_TTL`, 0 disables it.
+
+    :param capacity: maximum number of service definitions to keep
+    :param capacity_bytes: maximum total `ServiceDef.estimated_size()`
+        of the service definitions to keep.  The size is estimated once
+        when a service definition is added and is not updated as the
+        schemas of a lazy one are parsed, so lazy service definitions
+        may use more than their estimate.
+
+    When adding a service definition exceeds a capacity, the least
+    recently used ones that are not pinned (see `pin()`) are evicted.
+    They are loaded again via the hooks when next needed, so hooks
+    must be able to load them again.  Instances of evicted service
+    definitions held elsewhere remain usable.
+
     """
 
-    def __init__(self):
+    def __init__(self, negative_cache_ttl=None, capacity=None,
+                 capacity_bytes=None):
         self.by_id = {}
         self.by_name = {}
 
+        self.capacity = capacity
+        self.capacity_bytes = capacity_bytes
+
+        # Ids in order of use, least recent first
+        self._lru = OrderedDict()
+
+        # Estimated sizes by id, if capacity_bytes is set
+        self._sizes = {}
+        self.total_size = 0
+
+        # Pin counts by id
+        self._pins = {}
+
+        # Number of service definitions evicted
+        self.evictions = 0
+
+        if negative_cache_ttl is None:
+            negative_cache_ttl = reschema.settings.NEGATIVE_CACHE_TTL
+        self.negative_cache_ttl = negative_cache_ttl
+
+        # (expiry, exception) of failed loads, by ('id', id) or
+        # ('name', fullname)
+        self._negative_cache = {}
+
+        # Lookups that failed from the negative cache, and lookups
+        # that ran the load hooks
+        self.negative_cache_hits = 0
+        self.negative_cache_misses = 0
+
         # List of hooks to call in order to load schemas for as
         # yet unknown ids
         self._load_hooks = []
 
+        # Guards by_id, by_name and _loading
+        self._lock = threading.RLock()
+
+        # (future, thread) of the loads in progress, by ('id', id) or
+        # ('name', fullname)
+        self._loading = {}
+
     def add_load_hook(self, load_hook):
         """ Add a callable hook to load a schema by id.
 
@@ -141,35 +245,378 @@ class ServiceDefManager(object):
             interface
 
         Hooks are processed in order until the first hook
-        returns a ServiceDef instance.
+        returns a ServiceDef instance.  The negative cache is
+        cleared, as the new hook may find what others could not.
 
         """
         self._load_hooks.append(load_hook)
+        self.invalidate_negative_cache()
+
+    def invalidate_negative_cache(self, key=None):
+        """ Forget failed loads, so the hooks are tried again.
+
+        :param key: an id or a (name, version, provider) tuple to
+            forget, or None to forget all
+
+        """
+        with self._lock:
+            if key is None:
+                self._negative_cache.clear()
+            elif isinstance(key, tuple):
+                self._negative_cache.pop(('name', key), None)
+            else:
+                self._negative_cache.pop(('id', key), None)
+
+    def freeze(self):
+        """ Freeze all known service definitions.
+
+        Calls `ServiceDef.freeze()` on every registered instance.
+        Freezing may cause additional service definitions to be loaded
+        via hooks in order to resolve remote references, these are
+        frozen as well.
+
+        """
+        frozen = set()
+        while True:
+            pending = [s for s in list(self.by_id.values())
+                       if s.id not in frozen]
+            if not pending:
+                break
+            for servicedef in pending:
+                servicedef.freeze()
+                frozen.add(servicedef.id)
 
     def clear(self):
         """ Clear all known schemas. """
         logger.info("ServiceDefManager cleared")
-        self.by_id = {}
-        self.by_name = {}
+        with self._lock:
+            self.by_id = {}
+            self.by_name = {}
+            self._lru.clear()
+            self._sizes.clear()
+            self.total_size = 0
+            self._pins.clear()
+            self._negative_cache.clear()
+
+    def remove(self, servicedef):
+        """ Remove a ServiceDef instance, e.g. before loading a new version.
+
+        Other known service definitions drop their resolved references
+        into `servicedef`, so that it can be freed.
+
+        :raises InvalidServiceId: `servicedef` is not known
+
+        """
+        sid = servicedef.id
+        with self._lock:
+            if self.by_id.get(sid) is not servicedef:
+                raise InvalidServiceId("Unknown service definition: %s" %
+                                       sid)
+
+            logger.info("ServiceDefManager: removed schema: %s" % sid)
+            self._pins.pop(sid, None)
+            self._unregister(servicedef)
+            servicedef.manager = None
+
+        self._drop_references([servicedef])
+
+    def _unregister(self, servicedef):
+        """ Remove servicedef from the indexes, with the lock held. """
+        sid = servicedef.id
+        del self.by_id[sid]
+        fullname = (servicedef.name, servicedef.version, servicedef.provider)
+        if self.by_name.get(fullname) is servicedef:
+            del self.by_name[fullname]
+        del self._lru[sid]
+        self.total_size -= self._sizes.pop(sid, 0)
+
+    def _drop_references(self, removed):
+        """ Make the known service definitions forget `removed`. """
+        if not removed:
+            return
+        with self._lock:
+            others = list(self.by_id.values())
+
+        for other in others:
+            for servicedef in removed:
+                other.drop_references(servicedef)
+
+        for servicedef in removed:
+            if Schema.servicedefs.get(servicedef.id) is servicedef:
+                del Schema.servicedefs[servicedef.id]
 
     def add(self, servicedef):
-        """ Add a new ServiceDef instance known at the given id. """
+        """ Add a new ServiceDef instance known at the given id.
+
+        Adding may evict other service definitions, see `capacity`.
+
+        """
+        size = self._estimated_size(servicedef)
+        with self._lock:
+            evicted = self._add(servicedef, size)
+        self._drop_references(evicted)
+
+    def _estimated_size(self, servicedef):
+        """ Return the size to account for servicedef, see `_add()`. """
+        if self.capacity_bytes is None:
+            return 0
+        return servicedef.estimated_size()
+
+    def _add(self, servicedef, size=0):
+        """ Add servicedef with the lock held.
+
+        :param size: the `_estimated_size()` of servicedef, computed
+            before taking the lock as it walks the whole servicedef
+        :return: list of the service definitions evicted
+
+        """
         logger.debug("%s add: %s" % (self, servicedef.id))
         sid = servicedef.id
+        fullname = (servicedef.name, servicedef.version, servicedef.provider)
         if sid in self.by_id:
             if self.by_id[sid] != servicedef:
                 logger.debug("ids: %s" % (list(self.by_id.keys())))
                 raise DuplicateServiceId(sid)
-            return
+            return []
 
         self.by_id[sid] = servicedef
-
-        fullname = (servicedef.name, servicedef.version, servicedef.provider)
         self.by_name[fullname] = servicedef
+        self._lru[sid] = None
+        if self.capacity_bytes is not None:
+            self._sizes[sid] = size
+            self.total_size += size
+        self._negative_cache.pop(('id', sid), None)
+        self._negative_cache.pop(('name', fullname), None)
 
         logger.info("ServiceDefManager: registered new schema: %s, %s" %
                     (fullname, sid))
         servicedef.manager = self
+        return self._evict()
+
+    def _over_capacity(self):
+        return ((self.capacity is not None and
+                 len(self.by_id) > self.capacity) or
+                (self.capacity_bytes is not None and
+                 self.total_size > self.capacity_bytes))
+
+    def _evict(self):
+        """ Evict unpinned service definitions while over capacity.
+
+        Called with the lock held.  The most recently used one is
+        never evicted.  Evicted instances keep their `manager`, so
+        they can still resolve references if in use elsewhere.
+
+        :return: list of the service definitions evicted
+
+        """
+        evicted = []
+        if not self._over_capacity():
+            return evicted
+        for sid in list(self._lru)[:-1]:
+            if sid in self._pins:
+                continue
+            servicedef = self.by_id[sid]
+            logger.info("ServiceDefManager: evicted schema: %s" % sid)
+            self._unregister(servicedef)
+            evicted.append(servicedef)
+            self.evictions += 1
+            if not self._over_capacity():
+                break
+        return evicted
+
+    def _touch(self, servicedef):
+        """ Mark servicedef as most recently used. """
+        if servicedef.id in self._lru:
+            self._lru.move_to_end(servicedef.id)
+
+    def pin(self, servicedef):
+        """ Keep a service definition from being evicted.
+
+        Pins are counted, each `pin()` must be matched by `unpin()`.
+
+        :param servicedef: a ServiceDef instance or id, loaded via
+            the hooks if needed
+        :return: the ServiceDef instance
+
+        """
+        while True:
+            if isinstance(servicedef, str):
+                instance = self.find_by_id(servicedef)
+            else:
+                instance = servicedef
+            with self._lock:
+                sid = instance.id
+                if self.by_id.get(sid) is instance:
+                    self._pins[sid] = self._pins.get(sid, 0) + 1
+                    return instance
+            if instance is servicedef:
+                raise InvalidServiceId("Unknown service definition: %s" %
+                                       sid)
+            # Evicted by another thread meanwhile, load it again
+
+    def unpin(self, servicedef):
+        """ Undo `pin()`, the service definition may then be evicted.
+
+        :param servicedef: a ServiceDef instance or id
+        :raises ReschemaException: `servicedef` is not pinned
+
+        """
+        sid = servicedef if isinstance(servicedef, str) else servicedef.id
+        with self._lock:
+            count = self._pins.get(sid)
+            if count is None:
+                raise ReschemaException(
+                    "Service definition is not pinned: %s" % sid)
+            if count > 1:
+                self._pins[sid] = count - 1
+                return
+            del self._pins[sid]
+            evicted = self._evict()
+        self._drop_references(evicted)
+
+    def reload_changed(self):
+        """ Reload the service definitions whose source file changed.
+
+        Checks the size and modification time of the file each known
+        service definition was loaded from, see
+        `ServiceDef.source_changed()`.  Changed ones are updated in
+        place by `ServiceDef.reload()`, which only parses the types and
+        resources that changed.  If that is not possible, e.g. the 'id'
+        changed or it is frozen, a new instance is loaded from the file
+        to replace it.  Errors are logged and the previous definition
+        is kept.
+
+        Frozen service definitions keep their resolved references, so
+        those that depend on a reloaded one, directly or not, are
+        replaced as well.  Replacements of frozen ones are frozen.
+
+        :return: dict of the id of each reloaded servicedef to the set
+            of (section, name) that changed, or None if replaced
+
+        """
+        with self._lock:
+            servicedefs = list(self.by_id.values())
+
+        reloaded = {}
+        refreeze = []
+        for servicedef in servicedefs:
+            if not servicedef.source_changed():
+                continue
+            sid = servicedef.id
+            try:
+                try:
+                    reloaded[sid] = servicedef.reload()
+                    logger.info("ServiceDefManager: reloaded %s: %s" %
+                                (sid, sorted(reloaded[sid])))
+                except UnsupportedUpdate as e:
+                    logger.info("ServiceDefManager: replacing %s: %s" %
+                                (sid, e))
+                    new = self._replace(servicedef)
+                    if servicedef.frozen:
+                        refreeze.append(new)
+                    reloaded[sid] = None
+            except Exception:
+                logger.exception("ServiceDefManager: failed to reload %s "
+                                 "from %s" % (sid, servicedef.source_file))
+
+        changed = set(sid for sid, names in reloaded.items()
+                      if names is None or names)
+        for servicedef in self._frozen_dependents(changed):
+            sid = servicedef.id
+            if servicedef.source_file is None:
+                logger.warning("ServiceDefManager: frozen %s refers to "
+                               "reloaded service definitions and has no "
+                               "source file to reload" % sid)
+                continue
+            try:
+                refreeze.append(self._replace(servicedef))
+                reloaded[sid] = None
+                logger.info("ServiceDefManager: replaced frozen %s" % sid)
+            except Exception:
+                logger.exception("ServiceDefManager: failed to replace "
+                                 "frozen %s, it refers to reloaded service "
+                                 "definitions" % sid)
+
+        # Once all are replaced, so references resolve to the new ones
+        for servicedef in refreeze:
+            try:
+                servicedef.freeze()
+            except Exception:
+                logger.exception("ServiceDefManager: failed to freeze %s" %
+                                 servicedef.id)
+        return reloaded
+
+    def _frozen_dependents(self, ids):
+        """ Return the frozen servicedefs that depend on any of `ids`.
+
+        Includes those that depend on them through other frozen ones.
+
+        """
+        with self._lock:
+            frozen = [s for s in self.by_id.values()
+                      if s.frozen and s.id not in ids]
+        ids = set(ids)
+        dependents = []
+        found = True
+        while found:
+            found = False
+            for servicedef in frozen:
+                if (  servicedef.id not in ids and
+                      servicedef.dependencies & ids):
+                    ids.add(servicedef.id)
+                    dependents.append(servicedef)
+                    found = True
+        return dependents
+
+    def _replace(self, servicedef):
+        """ Replace servicedef by a new instance loaded from its file.
+
+        :return: the new instance
+
+        """
+        new = ServiceDef(readonly_input=servicedef.readonly_input,
+                         lazy=servicedef.lazy,
+                         release_input=servicedef.release_input,
+                         lean=servicedef.lean)
+        new.load(servicedef.source_file)
+        if new.id != servicedef.id and new.id in self.by_id:
+            raise DuplicateServiceId(new.id)
+
+        pins = self._pins.get(servicedef.id)
+        self.remove(servicedef)
+        self.add(new)
+        if pins:
+            with self._lock:
+                self._pins[new.id] = pins
+        return new
+
+    def watch(self, interval=1.0, callback=None):
+        """ Call `reload_changed()` every `interval` seconds.
+
+        Runs in a daemon thread until the returned event is set.
+
+        :param interval: seconds between checks
+        :param callback: called with the result of `reload_changed()`
+            when anything was reloaded
+        :return: a `threading.Event`, set it to stop watching
+
+        """
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                reloaded = self.reload_changed()
+                if reloaded and callback is not None:
+                    try:
+                        callback(reloaded)
+                    except Exception:
+                        logger.exception("ServiceDefManager: watch "
+                                         "callback failed")
+
+        thread = threading.Thread(target=run, daemon=True,
+                                  name='ServiceDefManager.watch')
+        thread.start()
+        return stop
 
     def find_by_id(self, id_):
         """ Resolve an id_ to a servicedef instance.
@@ -181,26 +628,175 @@ class ServiceDefManager(object):
             be loaded
 
         """
-        if id_ not in self.by_id:
-            # Not found -- try loading via our hooks
-            servicedef = None
-            for hook in self._load_hooks:
-                try:
-                    servicedef = hook.find_by_id(id_)
-                except:
-                    tb = traceback.format_exc()
-                    raise ReschemaLoadHookException(tb)
-                if servicedef:
-                    break
-            if servicedef is None:
-                raise InvalidServiceId(
-                    "Failed to load service definition: %s" % id_)
-            self.add(servicedef)
-        else:
-            servicedef = self.by_id[id_]
+        return self._find(('id', id_), self.by_id, id_,
+                          lambda: self._load_by_id(id_))
+
+    def _find(self, key, known, name, load):
+        """ Return known[name], or load and add it once for all threads.
+
+        :param key: key of the load in `_loading`
+        :param known: `by_id` or `by_name`
+        :param name: the id or fullname
+        :param load: called to load the servicedef via the hooks
 
+        """
+        with self._lock:
+            servicedef = known.get(name)
+            if servicedef is not None:
+                self._touch(servicedef)
+                return servicedef
+            failed = self._negative_cache.get(key)
+            if failed is not None:
+                expiry, error = failed
+                if time.monotonic() < expiry:
+                    self.negative_cache_hits += 1
+                    raise type(error)(*error.args)
+                del self._negative_cache[key]
+            loading = self._loading.get(key)
+            if loading is None:
+                self.negative_cache_misses += 1
+                future = Future()
+                self._loading[key] = (future, threading.get_ident())
+            elif loading[1] == threading.get_ident():
+                raise ReschemaException(
+                    "Recursive load of service definition: %s" % (name,))
+
+        if loading is not None:
+            # Wait for the thread that is loading it
+            return loading[0].result()
+
+        try:
+            servicedef = load()
+            size = self._estimated_size(servicedef)
+            with self._lock:
+                # Another thread may have added it by id or by name
+                servicedef = self.by_id.get(servicedef.id, servicedef)
+                self._touch(servicedef)
+                evicted = self._add(servicedef, size)
+            future.set_result(servicedef)
+        except BaseException as e:
+            if (  self.negative_cache_ttl and
+                  isinstance(e, (InvalidServiceId, InvalidServiceName,
+                                 ReschemaLoadHookException))):
+                self._add_negative(key, e)
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._loading[key]
+
+        self._drop_references(evicted)
         return servicedef
 
+    def _add_negative(self, key, error):
+        now = time.monotonic()
+        with self._lock:
+            # Drop expired entries
+            for k, (expiry, _) in list(self._negative_cache.items()):
+                if expiry <= now:
+                    del self._negative_cache[k]
+            self._negative_cache[key] = (now + self.negative_cache_ttl,
+                                         error)
+
+    async def find_by_id_async(self, id_):
+        """ Coroutine version of `find_by_id()`.
+
+        Load hooks run in the default executor of the event loop.
+
+        """
+        with self._lock:
+            servicedef = self.by_id.get(id_)
+            if servicedef is not None:
+                self._touch(servicedef)
+                return servicedef
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.find_by_id, id_)
+
+    async def find_by_name_async(self, name, version, provider='riverbed'):
+        """ Coroutine version of `find_by_name()`.
+
+        Load hooks run in the default executor of the event loop.
+
+        """
+        with self._lock:
+            servicedef = self.by_name.get((name, version, provider))
+            if servicedef is not None:
+                self._touch(servicedef)
+                return servicedef
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.find_by_name,
+                                          name, version, provider)
+
+    def _load_by_id(self, id_):
+        """ Load a servicedef via the hooks without adding it. """
+        servicedef = None
+        for hook in self._load_hooks:
+            try:
+                servicedef = hook.find_by_id(id_)
+            except:
+                tb = traceback.format_exc()
+                raise ReschemaLoadHookException(tb)
+            if servicedef:
+                break
+        if servicedef is None:
+            raise InvalidServiceId(
+                "Failed to load service definition: %s" % id_)
+        return servicedef
+
+    def prefetch(self, servicedef, max_workers=None):
+        """ Load all service definitions `servicedef` depends on.
+
+        The ids referenced by `$ref` (see `ServiceDef.dependencies`)
+        that are not yet known are loaded concurrently via the hooks
+        on a thread pool, followed by their own dependencies and so on.
+        Hooks must therefore be thread safe.  An id that fails to load
+        is logged and skipped, the error is raised again when a
+        reference to it is resolved.
+
+        :param servicedef: a ServiceDef instance or id
+        :param max_workers: size of the thread pool
+        :return: the dependency graph, a dict mapping the id of
+            `servicedef` and of each servicedef it depends on, directly
+            or indirectly, to the set of ids it depends on
+
+        """
+        if isinstance(servicedef, str):
+            servicedef = self.find_by_id(servicedef)
+
+        graph = {}
+        seen = set([servicedef.id])
+        todo = [servicedef]
+        futures = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while todo or futures:
+                while todo:
+                    s = todo.pop()
+                    graph[s.id] = set(s.dependencies)
+                    for id_ in s.dependencies - seen:
+                        seen.add(id_)
+                        if id_ in self.by_id:
+                            todo.append(self.by_id[id_])
+                        else:
+                            future = executor.submit(self.find_by_id, id_)
+                            futures[future] = id_
+
+                if not futures:
+                    break
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    id_ = futures.pop(future)
+                    try:
+                        s = future.result()
+                    except (ReschemaException,
+                            ReschemaLoadHookException) as e:
+                        logger.warning("ServiceDefManager: failed to "
+                                       "prefetch %s: %s" % (id_, e))
+                        graph[id_] = set()
+                        continue
+                    todo.append(s)
+
+        return graph
+
     def find_by_name(self, name, version, provider='riverbed'):
         """ Resolve <provider/name/version> triplet to a servicedef instance.
 
@@ -218,27 +814,72 @@ class ServiceDefManager(object):
 
         """
         fullname = (name, version, provider)
-        if fullname not in self.by_name:
-            # Not found -- try loading via our hooks
-            servicedef = None
-            for hook in self._load_hooks:
-                try:
-                    servicedef = hook.find_by_name(name, version, provider)
-                except:
-                    tb = traceback.format_exc()
-                    raise ReschemaLoadHookException(tb)
-                if servicedef:
-                    break
-            if servicedef is None:
-                raise InvalidServiceName(
-                    "Failed to load service definition: %s/%s/%s" %
-                    fullname)
+        return self._find(('name', fullname), self.by_name, fullname,
+                          lambda: self._load_by_name(*fullname))
+
+    def _load_by_name(self, name, version, provider):
+        """ Load a servicedef via the hooks without adding it. """
+        servicedef = None
+        for hook in self._load_hooks:
+            try:
+                servicedef = hook.find_by_name(name, version, provider)
+            except:
+                tb = traceback.format_exc()
+                raise ReschemaLoadHookException(tb)
+            if servicedef:
+                break
+        if servicedef is None:
+            raise InvalidServiceName(
+                "Failed to load service definition: %s/%s/%s" %
+                (name, version, provider))
+        return servicedef
 
-            self.add(servicedef)
-        else:
-            servicedef = self.by_name[fullname]
 
-        return servicedef
+class LazySchemaDict(Mapping):
+    """ Read-only mapping of names to schemas parsed on first access.
+
+    Used for `ServiceDef.types` and `ServiceDef.resources` when the
+    service definition is created with `lazy=True`.  Iterating over
+    keys does not parse anything, but `values()` and `items()` parse
+    every entry.
+
+    :param servicedef: the ServiceDef the schemas belong to
+    :param section: 'types' or 'resources'
+    :param inputs: dict of name to raw schema input
+
+    """
+
+    def __init__(self, servicedef, section, inputs):
+        self.servicedef = servicedef
+        self.section = section
+        self.inputs = inputs
+        self._schemas = {}
+
+    def __getitem__(self, name):
+        try:
+            return self._schemas[name]
+        except KeyError:
+            pass
+
+        sch = Schema.parse(self.inputs[name],
+                           name=name,
+                           id='#/%s/%s' % (self.section, name),
+                           servicedef=self.servicedef)
+        self._schemas[name] = sch
+        return sch
+
+    def __contains__(self, name):
+        return name in self.inputs
+
+    def __iter__(self):
+        return iter(self.inputs)
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def is_parsed(self, name):
+        """ Return True if the schema for `name` has been parsed. """
+        return name in self._schemas
 
 
 class ServiceDef(object):
@@ -250,10 +891,59 @@ class ServiceDef(object):
 
     :param manager: The ServiceManager, if any, that is keeping track
         of this particular service definition.
+
+    :param readonly_input: If True, `parse()` leaves the input object
+        unmodified, so the same raw input may be parsed by several
+        ServiceDef instances.
+
+    :param lazy: If True, each type and resource is only parsed when
+        first accessed, see `LazySchemaDict`.  Errors in a type or
+        resource are then raised on access rather than by `parse()`,
+        use `check_references()` or `freeze()` to check the whole
+        definition.
+
+    :param release_input: If True, parsed schemas drop their reference
+        to the raw input once `parse()` is done, so the raw document
+        can be freed.  A compact copy of each type and resource is
+        kept to rebuild `Schema.input` on demand, as needed by
+        `$merge`.  Not supported with `lazy`.  With
+        `reschema.settings.COMPACT_MARKS` the mark table still
+        references the raw document.
+
+    :param lean: If True, `load()` doesn't keep documentation-only
+        fields (description, notes, example, tags, xmlSchema and
+        xmlExample) in memory.  Only their location in the source file
+        is recorded, and the value is read back from the file (see
+        `read_source()`) on access.  Only applies to ASCII JSON / YAML
+        files, values are kept as usual otherwise.
     """
 
-    def __init__(self, manager=None):
+    def __init__(self, manager=None, readonly_input=False, lazy=False,
+                 release_input=False, lean=False):
+        if lazy and release_input:
+            raise ValueError("'lazy' and 'release_input' are exclusive")
         self.manager = manager
+        self.readonly_input = readonly_input
+        self.lazy = lazy
+        self.release_input = release_input
+        self._released_inputs = {}
+        self.lean = lean
+        # (filename, format) documentation fields are read from, set
+        # by load() for a lean servicedef
+        self.lean_source = None
+        self.frozen = False
+        # Parsed schemas by id relative to this servicedef, the
+        # schemas themselves are owned by types and resources
+        self.schemas = weakref.WeakValueDictionary()
+        # Memoized $merge results, see jsonmergepatch.merge()
+        self._merges = {}
+        self.dependencies = frozenset()
+        # File load() read from and its (size, mtime), see reload()
+        self.source_file = None
+        self._source_stat = None
+        # Digests of the input of each type and resource, kept for
+        # servicedefs loaded from a file, see update()
+        self._digests = None
 
     @classmethod
     def create_from_file(cls, filename, **kwargs):
@@ -270,54 +960,158 @@ class ServiceDef(object):
     def load(self, filename):
         """Loads and parses a JSON or YAML schema.
 
-        Support both JSON(.json) and YAML(.yml/.yaml) file formats
-        as detected by filename extensions.
+        Support JSON(.json), YAML(.yml/.yaml) and reschema binary (.rsb)
+        file formats as detected by filename extensions.
+
+        If `reschema.settings.CACHE_DIR` is set, the parsed result is
+        cached there and later loads of identical file contents skip
+        parsing entirely.
 
         :param filename: The path to the JSON or YAML file.
         :raises ValueError: if the file has an unsupported extension.
         """
 
-        if filename.endswith('.json'):
-            format = 'json'
+        format = _file_format(filename)
+        self.source_file = filename
+        self._source_stat = _file_stat(filename)
+
+        cache = None
+        # Compact marks are keyed by object identity, which doesn't
+        # survive a round trip through the cache.  Storing a lazy
+        # definition would parse everything up front, and a lean one
+        # refers to its source file.
+        compact = (reschema.settings.MARKED_LOAD and
+                   reschema.settings.COMPACT_MARKS)
+        if (  reschema.settings.CACHE_DIR and not compact and
+              not self.lazy and not self.lean):
+            cache = ServiceDefCache(reschema.settings.CACHE_DIR)
+            key = cache.key(self, filename)
+            if cache.load(self, key):
+                return
+
+        if self.lean and format != 'binary':
+            self._load_lean(filename, format)
+            return
 
-        elif filename.endswith(('.yml', '.yaml')):
-            format = 'yaml'
+        with open(filename, 'rb' if format == 'binary' else 'r') as f:
+            self.load_from_stream(f, format=format)
 
-        else:
-            raise ValueError(
-                "Unrecognized file extension, use '*.json' or '*.yaml': %s"
-                % filename)
+        if cache is not None:
+            cache.store(self, key)
 
+    def _load_lean(self, filename, format):
         with open(filename, 'r') as f:
-            return self.load_from_stream(f, format=format)
+            text = f.read()
 
-    def load_from_stream(self, f, format='yaml'):
-        """Loads and parses a JSON or YAML schema.
+        # Spans are character offsets, only the same as byte offsets
+        # into the file for ASCII
+        if not text.isascii():
+            self.load_from_stream(StringIO(text), format=format)
+            return
 
-        Support both JSON(.json) and YAML(.yml/.yaml) file formats
-        as detected by filename extensions.
+        stream = StringIO(text)
+        stream.name = filename
+        self.lean_source = (filename, format)
+        try:
+            self.load_from_stream(stream, format=format)
+        finally:
+            if not reschema.settings.MARKED_LOAD:
+                # Only loaded with marks to find spans
+                self.mark_table = None
+
+    def read_source(self, span):
+        """ Return the value at `span` in the source file, see `lean`.
+
+        :param span: a `reschema.loader_nodes.SourceSpan`
+        :raises ReschemaException: the source file was modified or
+            removed since it was loaded
 
-        :param f: An open file object.
-        :raises ValueError: if the file has an unsupported extension.
         """
+        filename, format = self.lean_source
+        try:
+            with open(filename, 'rb') as f:
+                st = os.fstat(f.fileno())
+                if (st.st_size, st.st_mtime_ns) != self._source_stat:
+                    raise ReschemaException(
+                        "%s: %s was modified since loaded, load it again"
+                        % (self.id, filename))
+
+                start = span.start
+                if format == 'json':
+                    # JSON marks start after the opening quote / bracket
+                    start -= 1
+                    column = 0
+                else:
+                    column = start - self._line_start(f, start)
+                f.seek(start)
+                data = f.read(span.end - start)
+        except OSError as e:
+            raise ReschemaException("%s: failed to read %s: %s" %
+                                    (self.id, filename, e))
+        if len(data) != span.end - start:
+            raise ReschemaException(
+                "%s: %s was truncated since loaded, load it again" %
+                (self.id, filename))
 
         if format == 'json':
-            if reschema.settings.MARKED_LOAD:
-                obj = json_loader.marked_load(f)
+            return json.loads(data.decode('ascii'),
+                              object_pairs_hook=OrderedDict)
+
+        # Indent the value as in the source, so that the lines of a
+        # block collection line up
+        return yaml_loader.ordered_load(' ' * column + data.decode('ascii'))
+
+    @staticmethod
+    def _line_start(f, index):
+        """Return the offset of the start of the line of `index` in f."""
+        size = 256
+        while index > 0:
+            start = max(0, index - size)
+            f.seek(start)
+            i = f.read(index - start).rfind(b'\n')
+            if i >= 0:
+                return start + i + 1
+            index = start
+            size *= 2
+        return 0
+
+    def load_from_stream(self, f, format='yaml'):
+        """Loads and parses a JSON, YAML or binary schema.
+
+        :param f: An open file object, in binary mode for 'binary'.
+        :param format: One of 'json', 'yaml' or 'binary', see
+            `reschema.binary_loader` for the latter.
+        :raises ValueError: if the format is not supported.
+        """
+        self.parse(self._read(f, format))
+
+    def _read(self, f, format):
+        """Return the raw input read from `f`, see `load_from_stream()`."""
+        marked = reschema.settings.MARKED_LOAD or self.lean_source
+        if format == 'json':
+            if marked:
+                obj = self._marked_load(json_loader, f)
             else:
                 obj = json.load(f, object_pairs_hook=OrderedDict)
 
         elif format == 'yaml':
-            if reschema.settings.MARKED_LOAD:
-                obj = yaml_loader.marked_load(f)
+            if marked:
+                obj = self._marked_load(yaml_loader, f)
             else:
                 obj = yaml_loader.ordered_load(f)
 
+        elif format == 'binary':
+            if reschema.settings.MARKED_LOAD:
+                obj = binary_loader.marked_load(f)
+            else:
+                obj = binary_loader.ordered_load(f)
+
         else:
             raise ValueError(
-                "Unrecognized format, use 'json' or 'yaml': %s" % format)
+                "Unrecognized format, use 'json', 'yaml' or 'binary': %s"
+                % format)
 
-        self.parse(obj)
+        return obj
 
     def parse_text(self, text, format='yaml'):
         """Loads and parses a schema from a string.
@@ -329,12 +1123,26 @@ class ServiceDef(object):
 
         stream = StringIO(text)
         if format == 'json':
-            obj = json_loader.marked_load(stream)
+            obj = self._marked_load(json_loader, stream)
         elif format == 'yaml' or format == 'yml':
-            obj = yaml_loader.marked_load(stream)
+            obj = self._marked_load(yaml_loader, stream)
 
         return self.parse(obj)
 
+    def _marked_load(self, loader, stream):
+        """Load from stream with marks, honoring COMPACT_MARKS.
+
+        In compact mode the MarkTable is kept by this instance, which
+        keeps the marks alive for as long as the parsed schemas.  A
+        lean load without MARKED_LOAD also uses a MarkTable, which is
+        dropped after parsing.
+        """
+        if (  reschema.settings.COMPACT_MARKS or
+              (self.lean_source and not reschema.settings.MARKED_LOAD)):
+            obj, self.mark_table = loader.compact_marked_load(stream)
+            return obj
+        return loader.marked_load(stream)
+
     def parse(self, obj):
         """Parses a Python data object representing a schema.
 
@@ -354,49 +1162,434 @@ class ServiceDef(object):
             if not parsed_id.netloc:
                 raise ParseError("Service definition 'id' property must be a "
                                  "fully qualified URI: %s" % id)
+            Schema.servicedefs[self.id] = self
 
-            # Preform some preprocessing:
-            #  - Expand all relative $ref targets to full absoslute references
-            parser.preprocess_input(self.id)
+            obj, self.dependencies = self._preprocess(parser)
+            if self.source_file is not None:
+                self._digests = _input_digests(obj)
 
             parser.parse('provider', required=True)
             parser.parse('name', required=True)
             parser.parse('version', required=True, types=str)
-            parser.parse('title', '')
-            parser.parse('status', '')
-
-            # 'description' is a doc property, supporting either:
-            #    'description' : <string>
-            #    'description' : { 'file': <filename>, 'format': <format> }
-            #    'description' : { 'text': <string>, 'format': <format> }
-            # where 'format' is optional and defaults to 'md'
-
-            parser.parse('description', '')
-
-            parser.parse('documentationLink', '')
-            parser.parse('defaultAuthorization')
-
-            self.types = OrderedDict()
-            for type_ in parser.parse('types', [], save=False):
-                self.types[type_] = Schema.parse(obj['types'][type_],
-                                                 name=type_,
-                                                 id='#/types/%s' % type_,
-                                                 servicedef=self)
-
-            self.resources = OrderedDict()
-            for resource in parser.parse('resources', [], save=False):
-                input_ = obj['resources'][resource]
-                sch = Schema.parse(input_,
-                                   name=resource,
-                                   id='#/resources/%s' % resource,
-                                   servicedef=self)
-                self.resources[resource] = sch
-
-            parser.parse('tasks')
-            parser.parse('request_headers')
-            parser.parse('response_headers')
-            parser.parse('errors')
-            parser.parse('tags', {}, types=dict)
+            self.__dict__.update(self._parse_props(parser))
+
+            if self.lazy:
+                self.types = LazySchemaDict(
+                    self, 'types', parser.parse('types', {}, save=False))
+                self.resources = LazySchemaDict(
+                    self, 'resources',
+                    parser.parse('resources', {}, save=False))
+
+            else:
+                self.types = OrderedDict()
+                for type_ in parser.parse('types', [], save=False):
+                    self.types[type_] = Schema.parse(obj['types'][type_],
+                                                     name=type_,
+                                                     id='#/types/%s' % type_,
+                                                     servicedef=self)
+
+                self.resources = OrderedDict()
+                for resource in parser.parse('resources', [], save=False):
+                    input_ = obj['resources'][resource]
+                    sch = Schema.parse(input_,
+                                       name=resource,
+                                       id='#/resources/%s' % resource,
+                                       servicedef=self)
+                    self.resources[resource] = sch
+
+        if self.release_input:
+            self._release_inputs(obj)
+
+    def _preprocess(self, parser):
+        """Preprocess the input of `parser`.
+
+        Expands all relative $ref targets to full absolute references.
+
+        :return: tuple of the preprocessed input and the ids of other
+            service definitions it references
+
+        """
+        if self.readonly_input:
+            refs = parser.preprocess_input(self.id, readonly=True)
+        else:
+            refs = parser.preprocess_input(self.id)
+
+        ids = set(urllib.parse.urldefrag(ref)[0] for ref in refs)
+        ids.discard(self.id)
+        return parser.input, frozenset(ids)
+
+    def _parse_props(self, parser):
+        """Parse the top level properties other than the header, types
+        and resources.
+
+        :return: dict of the values by attribute name
+
+        """
+        props = {}
+        props['title'] = parser.parse('title', '', save=False)
+        props['status'] = parser.parse('status', '', save=False)
+
+        # 'description' is a doc property, supporting either:
+        #    'description' : <string>
+        #    'description' : { 'file': <filename>, 'format': <format> }
+        #    'description' : { 'text': <string>, 'format': <format> }
+        # where 'format' is optional and defaults to 'md'
+
+        props['description'] = parser.parse('description', '', save=False)
+
+        props['documentationLink'] = parser.parse('documentationLink', '',
+                                                  save=False)
+        for prop in ('defaultAuthorization', 'tasks', 'request_headers',
+                     'response_headers', 'errors'):
+            props[prop] = parser.parse(prop, save=False)
+        props['tags'] = parser.parse('tags', {}, types=dict, save=False)
+        return props
+
+    def _release_inputs(self, obj):
+        """Drop input references from parsed schemas, see `release_input`.
+
+        Input is only dropped if it can be found again by using the
+        schema id as a pointer into the compact copy.  Types and
+        resources with values the compact copy can't store keep their
+        input.
+        """
+        for section in ('types', 'resources'):
+            for name, input_ in (obj.get(section) or {}).items():
+                try:
+                    self._released_inputs[(section, name)] = \
+                        binary_loader.dumps(input_)
+                except binary_loader.UnsupportedValue as e:
+                    logger.debug("Keeping input of %s/%s: %s" %
+                                 (section, name, e))
+
+        for e in self.entity_iter():
+            if not isinstance(e, Schema) or e._input is None:
+                continue
+            try:
+                parts = JsonPointer(e.id[1:]).parts
+                found = resolve_pointer(obj, e.id[1:])
+            except JsonPointerException:
+                continue
+            if (  found is e._input and
+                  tuple(parts[:2]) in self._released_inputs):
+                e._input = None
+
+    def released_input(self, id):
+        """ Rebuild the raw input for schema `id`, or None.
+
+        :param id: schema id relative to this servicedef
+
+        """
+        try:
+            parts = JsonPointer(id[1:]).parts
+        except JsonPointerException:
+            return None
+        data = self._released_inputs.get(tuple(parts[:2]))
+        if data is None:
+            return None
+        return JsonPointer.from_parts(parts[2:]).resolve(
+            binary_loader.loads(data))
+
+    def schema_by_id(self, id):
+        """ Return the parsed schema `id` of this servicedef, or None.
+
+        For a lazy servicedef, the type or resource containing `id` is
+        parsed if needed.
+
+        :param id: schema id relative to this servicedef
+
+        """
+        sch = self.schemas.get(id)
+        if sch is None and self.lazy:
+            try:
+                parts = JsonPointer(id[1:]).parts
+            except JsonPointerException:
+                return None
+            if len(parts) >= 2 and parts[0] in ('types', 'resources'):
+                getattr(self, parts[0]).get(parts[1])
+                sch = self.schemas.get(id)
+        return sch
+
+    def find_schema_by_id(self, fullid):
+        """ Return the parsed schema with absolute id `fullid`, or None.
+
+        Other service definitions are only looked up among those known
+        to the manager, or without a manager, among all live instances.
+        Use `find()` to load them via the manager's hooks.
+
+        """
+        base, _, fragment = fullid.partition('#')
+        if not base or base == self.id:
+            servicedef = self
+        elif self.manager is not None:
+            servicedef = self.manager.by_id.get(base)
+        else:
+            servicedef = Schema.servicedefs.get(base)
+        if servicedef is None:
+            return None
+        return servicedef.schema_by_id('#' + fragment)
+
+    def drop_references(self, servicedef, entities=None):
+        """ Forget resolved references into another `servicedef`.
+
+        Called when `servicedef` is removed from the manager, so it is
+        not kept alive by this one.  References are resolved again on
+        next use.
+
+        :param entities: if given, only references to these entities
+            of `servicedef` are dropped, see `update()`
+
+        A frozen servicedef is left unchanged, see `freeze()`.
+
+        """
+        if self.frozen:
+            return
+
+        if entities is None:
+            def dropped(target):
+                return target.servicedef is servicedef
+        else:
+            ids = set(id(e) for e in entities)
+
+            def dropped(target):
+                return id(target) in ids
+
+        self._merges.clear()
+        for e in self._walk(self._parsed_roots()):
+            if isinstance(e, jsonschema.Relation):
+                if e._resource is None or not dropped(e._resource):
+                    continue
+                e._resource = None
+
+            elif isinstance(e, jsonschema.DynamicSchema):
+                # A merged schema may include input of servicedef,
+                # so all merges are dropped
+                target = e._refschema
+                if target is None or (isinstance(e, jsonschema.Ref) and
+                                      not dropped(target)):
+                    continue
+                e._refschema = None
+                for name in ('links', 'relations'):
+                    try:
+                        object.__delattr__(e, name)
+                    except AttributeError:
+                        pass
+
+    def estimated_size(self):
+        """ Return an estimate of the memory used, in bytes.
+
+        Sums `sys.getsizeof()` of the objects reachable from this
+        servicedef, including its input, but not other service
+        definitions or the manager.  For a lazy servicedef, only the
+        schemas parsed so far are included.
+
+        """
+        size = 0
+        seen = set()
+        stack = [self]
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+
+            if isinstance(obj, jsonschema.Entity):
+                if obj.servicedef is not self:
+                    continue
+                for name in jsonschema._slot_names(type(obj)):
+                    try:
+                        # Not getattr(), DynamicSchema would resolve
+                        stack.append(object.__getattribute__(obj, name))
+                    except AttributeError:
+                        pass
+            elif obj is self or isinstance(obj, LazySchemaDict):
+                stack.extend(vars(obj).values())
+            elif isinstance(obj, (ServiceDef, ServiceDefManager,
+                                  weakref.WeakValueDictionary)):
+                continue
+            elif isinstance(obj, dict):
+                stack.extend(obj.keys())
+                stack.extend(obj.values())
+            elif isinstance(obj, (list, tuple, set, frozenset)):
+                stack.extend(obj)
+            size += sys.getsizeof(obj)
+        return size
+
+    def source_changed(self):
+        """ Return True if `source_file` was modified since loaded. """
+        if self.source_file is None:
+            return False
+        try:
+            return _file_stat(self.source_file) != self._source_stat
+        except OSError:
+            # Removed, keep what was loaded
+            return False
+
+    def reload(self):
+        """ Load `source_file` again, only parsing what changed.
+
+        See `update()`.  The file is not checked again until modified,
+        even if it fails to parse.
+
+        :return: set of (section, name) of the types and resources
+            changed, added or removed
+        :raises UnsupportedUpdate: the servicedef can't be updated in
+            place, a new instance must be loaded
+
+        """
+        if self.source_file is None:
+            raise UnsupportedUpdate("%s was not loaded from a file" %
+                                    self.id)
+        self._check_updatable()
+
+        format = _file_format(self.source_file)
+        source_stat = _file_stat(self.source_file)
+        try:
+            with open(self.source_file,
+                      'rb' if format == 'binary' else 'r') as f:
+                obj = self._read(f, format)
+            return self.update(obj)
+        finally:
+            self._source_stat = source_stat
+
+    def _check_updatable(self):
+        if self.frozen:
+            raise UnsupportedUpdate(
+                "%s: frozen service definitions can't be updated" %
+                self.id)
+        if self.lean or self.release_input:
+            raise UnsupportedUpdate(
+                "%s: lean or release_input service definitions can't "
+                "be updated" % self.id)
+        if getattr(self, 'mark_table', None) is not None:
+            raise UnsupportedUpdate(
+                "%s: service definitions with compact marks can't be "
+                "updated" % self.id)
+
+    def update(self, obj):
+        """ Update from a new version of the input, parsing what changed.
+
+        Types and resources whose input is unchanged keep their
+        schemas, changed ones are parsed again, or for a lazy
+        servicedef, on next access.  References into replaced schemas,
+        from this and the other service definitions known to the
+        manager, are resolved again on next use.
+
+        Concurrent readers may see a mix of old and new schemas while
+        this runs.  Source marks of unchanged schemas still refer to
+        the previous input.
+
+        :param obj: the new input, with the same 'id', 'name',
+            'version', 'provider' and '$schema'
+
+        :return: set of (section, name) of the types and resources
+            changed, added or removed
+        :raises UnsupportedUpdate: the servicedef can't be updated in
+            place, a new instance must be loaded
+        :raises ParseError: the input is invalid, the servicedef is
+            left unchanged
+
+        """
+        self._check_updatable()
+
+        with Parser(obj, '<servicdef>', self) as parser:
+            for prop, attr in (('$schema', 'schema'), ('id', 'id'),
+                               ('provider', 'provider'), ('name', 'name'),
+                               ('version', 'version')):
+                value = parser.parse(prop, required=True, save=False)
+                if value != getattr(self, attr):
+                    raise UnsupportedUpdate(
+                        "%s: '%s' changed to %r" % (self.id, prop, value))
+
+            obj, dependencies = self._preprocess(parser)
+            digests = _input_digests(obj)
+            if self._digests is not None:
+                old_keys = set(self._digests)
+            else:
+                old_keys = set(('types', name) for name in self.types)
+                old_keys.update(('resources', name)
+                                for name in self.resources)
+            changed = set(key for key, digest in digests.items()
+                          if (self._digests or {}).get(key) != digest)
+            removed = old_keys - set(digests)
+
+            # Parse into a separate registry, so a failure leaves
+            # this servicedef as it was
+            parsed = {}
+            registry = self.schemas
+            self.schemas = weakref.WeakValueDictionary()
+            try:
+                if not self.lazy:
+                    for section, name in sorted(changed):
+                        parsed[(section, name)] = Schema.parse(
+                            obj[section][name], name=name,
+                            id='#/%s/%s' % (section, name),
+                            servicedef=self)
+                props = self._parse_props(parser)
+                parser.parse('types', save=False)
+                parser.parse('resources', save=False)
+            finally:
+                registry, self.schemas = self.schemas, registry
+
+        # Everything reachable from the replaced schemas is stale
+        stale = []
+        roots = []
+        for section, name in changed | removed:
+            entries = getattr(self, section)
+            if isinstance(entries, LazySchemaDict):
+                entries = entries._schemas
+            if name in entries:
+                roots.append(entries[name])
+        while roots:
+            entities = list(self._walk(roots))
+            stale.extend(entities)
+            roots = [e._refschema for e in entities
+                     if isinstance(e, jsonschema.Merge) and
+                     e._refschema is not None]
+        for e in stale:
+            if self.schemas.get(e.id) is e:
+                del self.schemas[e.id]
+        self.schemas.update(registry)
+
+        for section in ('types', 'resources'):
+            old = getattr(self, section)
+            names = (obj.get(section) or {}).keys()
+            if self.lazy:
+                inputs = OrderedDict()
+                for name in names:
+                    if (section, name) in changed:
+                        old._schemas.pop(name, None)
+                        inputs[name] = obj[section][name]
+                    else:
+                        inputs[name] = old.inputs[name]
+                for name in old.inputs:
+                    if (section, name) in removed:
+                        old._schemas.pop(name, None)
+                old.inputs = inputs
+            else:
+                entries = OrderedDict()
+                for name in names:
+                    if (section, name) in parsed:
+                        entries[name] = parsed[(section, name)]
+                    else:
+                        entries[name] = old[name]
+                setattr(self, section, entries)
+
+        self.__dict__.update(props)
+        self.dependencies = dependencies
+        self._digests = digests
+
+        if changed or removed:
+            self.frozen = False
+            others = [self]
+            if self.manager is not None:
+                with self.manager._lock:
+                    others.extend(s for s in self.manager.by_id.values()
+                                  if s is not self)
+            for other in others:
+                other.drop_references(self, stale)
+
+        return changed | removed
 
     def check_references(self):
         """ Iterate through all schemas and check references.
@@ -431,6 +1624,145 @@ class ServiceDef(object):
 
         return errors
 
+    def freeze(self):
+        """ Resolve all references and mark this definition immutable.
+
+        Every `Ref.refschema`, `Merge.refschema` and `Relation.resource`
+        is resolved in a single pass, and links and relations of the
+        target schema are copied onto each reference.  Full names and
+        ids are computed up front as well.  Once frozen, reading never
+        modifies the object graph again, so the definition may be
+        shared by concurrent readers without locking.
+
+        Changes are rejected: setting validation keywords raises
+        ReschemaException and `update()` raises UnsupportedUpdate.
+        References are not dropped by `drop_references()`, so a frozen
+        servicedef keeps the service definitions it refers to alive
+        even if removed from or evicted by the manager.
+
+        :raises InvalidReference: if any reference cannot be resolved
+            or if a chain of references is circular.  All offending
+            references are reported at once.
+
+        """
+        if self.frozen:
+            return
+
+        errors = []
+        dynamic = []
+        for e in self.entity_iter(resolve=True):
+            if isinstance(e, jsonschema.DynamicSchema):
+                dynamic.append(e)
+            elif isinstance(e, jsonschema.Relation):
+                try:
+                    e.resource
+                except InvalidReference:
+                    errors.append(e.fullname())
+
+        for d in dynamic:
+            # Follow chains of references to detect cycles, such
+            # as two types that only reference each other
+            seen = set()
+            target = d
+            while isinstance(target, jsonschema.DynamicSchema):
+                if id(target) in seen:
+                    errors.append('%s (circular)' % d.fullname())
+                    target = None
+                    break
+                seen.add(id(target))
+                try:
+                    if isinstance(target, jsonschema.Ref):
+                        # Don't use refschema here, it would recurse
+                        # forever on a cycle while copying links
+                        target = (target._refschema or
+                                  target._find_refschema())
+                    else:
+                        target = target.refschema
+                except InvalidReference:
+                    errors.append(d.fullname())
+                    target = None
+                    break
+
+            if target is not None:
+                d.refschema
+                d.links = OrderedDict(target.links)
+                d.relations = OrderedDict(target.relations)
+
+        if errors:
+            raise InvalidReference('unresolved references: %s' %
+                                   ', '.join(errors), self.id)
+
+        for e in self.entity_iter(resolve=True):
+            e.fullname()
+            e.fullid()
+
+        self.frozen = True
+
+    def entity_iter(self, resolve=False):
+        """ Generator for iterating over all parsed entities
+
+        Yields every schema reachable from resources and types in
+        this service definition, along with their links, paths and
+        relations.
+
+        :param resolve: if True, also resolve each `Merge` and
+            descend into the merged schema.  Unresolvable merges
+            are yielded but not descended into.
+
+        """
+        roots = list(self.type_iter())
+        roots.extend(self.resource_iter())
+        return self._walk(roots, resolve)
+
+    def _parsed_roots(self):
+        """Return the types and resources parsed so far."""
+        roots = []
+        for section in (self.types, self.resources):
+            if isinstance(section, LazySchemaDict):
+                roots.extend(section._schemas.values())
+            else:
+                roots.extend(section.values())
+        return roots
+
+    def _walk(self, roots, resolve=False):
+        """Generator for the entities reachable from roots, see
+        `entity_iter()`."""
+        stack = list(roots)
+        stack.reverse()
+        seen = set()
+        while stack:
+            e = stack.pop()
+            if e is None or id(e) in seen:
+                continue
+            seen.add(id(e))
+            yield e
+
+            children = []
+            if isinstance(e, jsonschema.Schema):
+                children.extend(e.children)
+                if isinstance(e, jsonschema.Merge):
+                    if resolve:
+                        try:
+                            children.append(e.refschema)
+                        except InvalidReference:
+                            pass
+                elif not e.is_ref():
+                    children.extend(e.links.values())
+                    children.extend(e.relations.values())
+
+            elif isinstance(e, jsonschema.Link):
+                children.append(e._request)
+                children.append(e._response)
+                if e.path is not None and e.path.link is e:
+                    children.append(e.path)
+
+            elif isinstance(e, jsonschema.Path):
+                children.extend(s for (k, s) in e.var_schemas.items()
+                                if k != '$')
+
+            children.reverse()
+            stack.extend(children)
+
     def resource_iter(self):
         """ Generator for iterating over all resources """
         for r in self.resources:
@@ -19,6 +19,39 @@ LOAD_DESCRIPTIONS = ('RESCHEMA_LOAD_DESCRIPTIONS' in os.environ)
 #
 MARKED_LOAD = ('RESCHEMA_MARKED_LOAD' in os.environ)
 
+#
+# Set to True to keep marks from MARKED_LOAD in a compact side table
+# rather than on each loaded node (see reschema.loader_nodes).  Uses
+# much less memory, line / column numbers are computed on demand.
+#
+COMPACT_MARKS = ('RESCHEMA_COMPACT_MARKS' in os.environ)
+
+#
+# Set to True to use the libyaml based parser for MARKED_LOAD when
+# PyYAML was built with it.  Faster, but the marks have no source
+# buffer, so error messages don't show a snippet of the schema text.
+#
+LIBYAML_MARKS = ('RESCHEMA_LIBYAML_MARKS' in os.environ)
+
+#
+# Directory for caching fully parsed service definitions loaded
+# from files.  Disabled if None (default).  Entries are pickles, so
+# this must be a private, trusted location, see reschema.cache.
+#
+CACHE_DIR = os.environ.get('RESCHEMA_CACHE_DIR')
+
+#
+# Maximum depth of nested $merge evaluation, i.e. merges whose source
+# or patch is itself a merge.  Deeper nesting raises InvalidReference.
+#
+MAX_MERGE_DEPTH = int(os.environ.get('RESCHEMA_MAX_MERGE_DEPTH', 32))
+
+#
+# Number of seconds a ServiceDefManager remembers ids and names that
+# its load hooks could not load.  Disabled if 0 (default).
+#
+NEGATIVE_CACHE_TTL = float(os.environ.get('RESCHEMA_NEGATIVE_CACHE_TTL', 0))
+
 #
 # Set to True for verbose debugging
 #
@@ -5,6 +5,7 @@
 # as set forth in the License.
 
 import re
+import json
 from reschema.exceptions import ParseError
 
 # copy params from previous uritemplate version
@@ -30,6 +31,23 @@ def check_type(prop, val, valid_type, obj=None):
         raise ParseError(msg, prop, obj)
 
 
+def canonical_json(value):
+    """Return a canonical JSON string for value.
+
+    Keys are sorted, so equal dicts give equal strings regardless of
+    order.  Classes are represented by name, other non-JSON values by
+    their repr().
+    """
+    return json.dumps(value, sort_keys=True, separators=(',', ':'),
+                      default=_canonical_default)
+
+
+def _canonical_default(value):
+    if isinstance(value, type):
+        return value.__name__
+    return repr(value)
+
+
 def a_or_an(s):
     if s[0] in ('a', 'e', 'i', 'o', 'u'):
         return "an"
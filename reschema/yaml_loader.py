@@ -14,6 +14,17 @@
 """
 A PyYAML loader that annotates position in source code and uses an OrderedDict.
 
+When PyYAML was built with libyaml, `ordered_load` uses a loader built
+on the C parser (`COrderedLoader`), which is much faster on large files.
+Set `USE_LIBYAML` to False to force the pure-Python loader.
+
+`marked_load` and `compact_marked_load` use the pure-Python loaders
+unless `reschema.settings.LIBYAML_MARKS` is set.  Marks produced by
+the C parser carry the same name/index/line/column but no source
+buffer, so error messages don't include a snippet of the offending
+text, and block collections closed by the end of the stream end on
+the following line.
+
 The loader is based on `SafeConstructor`, i.e., the behaviour of
 `yaml.safe_load`, but in addition:
 
@@ -33,7 +44,21 @@ from yaml.resolver import Resolver
 from yaml.parser import Parser
 from yaml.constructor import SafeConstructor
 
-from reschema.loader_nodes import (dict_node, list_node, str_node)
+try:
+    from yaml.cyaml import CParser
+except ImportError:
+    CParser = None
+
+from reschema import settings
+from reschema.loader_nodes import (dict_node, list_node, str_node,
+                                   MarkTable)
+
+# Use the libyaml based loaders when available
+USE_LIBYAML = CParser is not None
+
+
+def _libyaml_marks():
+    return USE_LIBYAML and settings.LIBYAML_MARKS
 
 
 # Ordered so long as python 3.6+ is used.
@@ -47,7 +72,18 @@ class OrderedLoader(Reader, Scanner, Parser,
         SafeConstructor.__init__(self)
         Resolver.__init__(self)
 
+
+if CParser is not None:
+    class COrderedLoader(CParser, SafeConstructor, Resolver):
+        def __init__(self, stream):
+            CParser.__init__(self, stream)
+            SafeConstructor.__init__(self)
+            Resolver.__init__(self)
+
+
 def ordered_load(stream):
+    if USE_LIBYAML:
+        return COrderedLoader(stream).get_single_data()
     return OrderedLoader(stream).get_single_data()
 
 
@@ -87,10 +123,86 @@ class MarkedLoader(Reader, Scanner, Parser,
         Resolver.__init__(self)
 
 
+if CParser is not None:
+    class CMarkedLoader(CParser, MarkedNodeConstructor, Resolver):
+        def __init__(self, stream):
+            CParser.__init__(self, stream)
+            MarkedNodeConstructor.__init__(self)
+            Resolver.__init__(self)
+
+
 def marked_load(stream):
+    if _libyaml_marks():
+        return CMarkedLoader(stream).get_single_data()
     return MarkedLoader(stream).get_single_data()
 
 
+class CompactMarkedConstructor(SafeConstructor):
+    """Constructs plain objects, recording marks in `self.mark_table`."""
+
+    def construct_yaml_map(self, node):
+        obj, = super().construct_yaml_map(node)
+        self.mark_table.add(obj, node.start_mark.index, node.end_mark.index)
+        return obj
+
+    def construct_yaml_seq(self, node):
+        obj, = super().construct_yaml_seq(node)
+        self.mark_table.add(obj, node.start_mark.index, node.end_mark.index)
+        return obj
+
+    def construct_yaml_str(self, node):
+        obj = super().construct_yaml_str(node)
+        self.mark_table.add(obj, node.start_mark.index, node.end_mark.index)
+        return obj
+
+CompactMarkedConstructor.add_constructor(
+    'tag:yaml.org,2002:map', CompactMarkedConstructor.construct_yaml_map)
+
+CompactMarkedConstructor.add_constructor(
+    'tag:yaml.org,2002:seq', CompactMarkedConstructor.construct_yaml_seq)
+
+CompactMarkedConstructor.add_constructor(
+    'tag:yaml.org,2002:str', CompactMarkedConstructor.construct_yaml_str)
+
+
+class CompactMarkedLoader(Reader, Scanner, Parser,
+                          Composer, CompactMarkedConstructor, Resolver):
+    def __init__(self, stream):
+        Reader.__init__(self, stream)
+        Scanner.__init__(self)
+        Parser.__init__(self)
+        Composer.__init__(self)
+        CompactMarkedConstructor.__init__(self)
+        Resolver.__init__(self)
+
+
+if CParser is not None:
+    class CCompactMarkedLoader(CParser, CompactMarkedConstructor, Resolver):
+        def __init__(self, stream):
+            CParser.__init__(self, stream)
+            CompactMarkedConstructor.__init__(self)
+            Resolver.__init__(self)
+
+
+def compact_marked_load(stream):
+    """Load plain objects, returning a tuple `(data, MarkTable)`."""
+    if hasattr(stream, 'read'):
+        name = getattr(stream, 'name', '<file>')
+        text = stream.read()
+    else:
+        name = '<unicode string>'
+        text = stream
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+
+    if _libyaml_marks():
+        loader = CCompactMarkedLoader(text)
+    else:
+        loader = CompactMarkedLoader(text)
+    loader.mark_table = MarkTable(name, text)
+    return loader.get_single_data(), loader.mark_table
+
+
 def test_ordered_yaml():
 
     # note: test very sensitive to whitespace in string below
@@ -131,6 +243,43 @@ def test_marked_yaml():
     assert isinstance(d['a'], list)
 
 
+def test_compact_marked_yaml():
+    from reschema.loader_nodes import get_marks
+
+    def loc(obj):
+        start_mark, end_mark = get_marks(obj)
+        return (start_mark.line, start_mark.column,
+                end_mark.line, end_mark.column)
+
+    # note: test very sensitive to whitespace in string below
+    d, table = compact_marked_load('''\
+    a:
+      [b, c, {d: e}]
+    f:
+      g: h''')
+
+    assert d == {'a': ['b', 'c', {'d': 'e'}], 'f': {'g': 'h'}}
+    assert loc(d['a'][2]) == (1, 13, 1, 19)
+    assert loc(d['a']) == (1, 6, 1, 20)
+    assert loc(d['f']['g']) == (3, 9, 3, 10)
+
+    assert type(d['a'][2]['d']) is str
+    assert type(d) is dict
+    assert type(d['a']) is list
+
+
+def test_pure_python_yaml():
+    global USE_LIBYAML
+    saved = USE_LIBYAML
+    USE_LIBYAML = False
+    try:
+        test_ordered_yaml()
+    finally:
+        USE_LIBYAML = saved
+
+
 if __name__ == '__main__':
     test_ordered_yaml()
     test_marked_yaml()
+    test_compact_marked_yaml()
+    test_pure_python_yaml()
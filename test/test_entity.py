@@ -105,3 +105,17 @@ def test_name_intermediary():
     assert e.fullname() == '%s.%s.%s' % (ANY_PARENT_NAME,
                                          ANY_INTERMEDIARY,
                                          ANY_NAME)
+
+
+def test_names_computed_on_demand():
+    parent = mock.Mock()
+    parent.fullname.return_value = ANY_PARENT_NAME
+    parent.servicedef = MOCK_SERVICEDEF
+    e = jsonschema.Entity(id=ANY_ID, name=ANY_NAME, parent=parent)
+    assert not parent.fullname.called
+
+    assert e.fullname() == '%s.%s' % (ANY_PARENT_NAME, ANY_NAME)
+    calls = parent.fullname.call_count
+    assert e.fullname() is e.fullname()
+    assert parent.fullname.call_count == calls
+    assert e.fullid() is e.fullid()
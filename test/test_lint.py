@@ -1201,6 +1201,28 @@ class TestRelint(TestLintBase):
                           '  res:\n'
                           '    type: string\n')
 
+    def test_failure_marks(self):
+        """ Failures on required / default point at the source """
+        fragment = ('types:\n'
+                    '  foo:\n'
+                    '    type: object\n'
+                    '    additionalProperties: false\n'
+                    '    properties:\n'
+                    '      id: { type: string, default: none }\n'
+                    '    required: [id, missing]\n')
+        lines = (SERVICE_DEF_TEMPLATE + fragment).split('\n')
+
+        results = Validator().run(create_servicedef(fragment))
+        found = {}
+        for r in results:
+            if r.obj_id == '#/types/foo' and r.status == Result.FAILED:
+                found[r.rule_id] = r.exc
+
+        start = found['E0002'].start_mark
+        self.assertEqual(lines[start.line][start.column:], 'missing]')
+        start = found['W0006'].start_mark
+        self.assertEqual(lines[start.line][start.column:], 'none }')
+
     def test_rule_W0006(self):
         """ A required property should not have a default value """
         self.check_result('W0006', '#/resources/foo', Result.PASSED,
@@ -7,7 +7,8 @@
 import os
 import unittest
 
-from reschema.exceptions import ReschemaException
+import reschema.settings
+from reschema.exceptions import ReschemaException, ParseError
 from reschema import ServiceDef, ServiceDefManager
 
 """
@@ -106,3 +107,79 @@ class TestMarkedLoad(unittest.TestCase):
         with self.assertRaises(ReschemaException):
             r = ServiceDef()
             r.parse_text(json_snippet_bad)
+
+    def test_bad_yaml_compact(self):
+        text = (
+            "$schema: 'http://support.riverbed.com/apis/service_def/2.2'\n"
+            "id: 'http://support.riverbed.com/apis/bookstore/1.0'\n"
+            "provider: 'riverbed'\n"
+            "name: 'bookstore'\n"
+            "version: '1.0'\n"
+            "resources:\n"
+            "   info:\n"
+            "      type: object\n"
+            "      invalid_type: foo\n")
+
+        reschema.settings.COMPACT_MARKS = True
+        try:
+            r = ServiceDef()
+            with self.assertRaises(ParseError) as cm:
+                r.parse_text(text, format='yaml')
+        finally:
+            reschema.settings.COMPACT_MARKS = False
+
+        self.assertEqual(cm.exception.start_mark.line, 8)
+        self.assertEqual(cm.exception.start_mark.column, 6)
+
+    def test_obj_key_node(self):
+        from reschema import yaml_loader
+        from reschema.loader_nodes import obj_key_node, get_marks
+
+        text = 'a: 1\nb: 2\nc: 3\n'
+        compact, table = yaml_loader.compact_marked_load(text)
+        for obj in (yaml_loader.marked_load(text), compact):
+            key = obj_key_node(obj, 'b')
+            self.assertEqual(key, 'b')
+            self.assertEqual(get_marks(key)[0].line, 1)
+            self.assertIsNone(obj_key_node(obj, 'd'))
+
+            obj['d'] = 4
+            self.assertEqual(obj_key_node(obj, 'd'), 'd')
+            del obj['d']
+            self.assertIsNone(obj_key_node(obj, 'd'))
+
+        self.assertEqual(obj_key_node({'x': 1}, 'x'), 'x')
+        self.assertIsNone(obj_key_node({'x': 1}, 'y'))
+
+    def test_libyaml_marks(self):
+        from reschema import yaml_loader
+
+        text = 'a:\n  [b, c]\nf:\n  g: h'
+
+        # Pure-Python marks by default, with a buffer for snippets
+        saved = reschema.settings.LIBYAML_MARKS
+        reschema.settings.LIBYAML_MARKS = False
+        try:
+            d = yaml_loader.marked_load(text)
+        finally:
+            reschema.settings.LIBYAML_MARKS = saved
+        self.assertIsNotNone(d.start_mark.get_snippet())
+        self.assertEqual((d.end_mark.line, d.end_mark.column), (3, 6))
+        self.assertEqual((d['a'].start_mark.line, d['a'].start_mark.column,
+                          d['a'].end_mark.line, d['a'].end_mark.column),
+                         (1, 2, 1, 8))
+
+        if yaml_loader.CParser is None:
+            self.skipTest('PyYAML was built without libyaml')
+
+        reschema.settings.LIBYAML_MARKS = True
+        try:
+            c = yaml_loader.marked_load(text)
+        finally:
+            reschema.settings.LIBYAML_MARKS = saved
+
+        self.assertEqual(c, d)
+        self.assertIsNone(c.start_mark.get_snippet())
+        self.assertEqual((c['a'].start_mark.line, c['a'].start_mark.column,
+                          c['a'].end_mark.line, c['a'].end_mark.column),
+                         (1, 2, 1, 8))
@@ -94,6 +94,41 @@ def test_expanded_refs_array():
     assert input_ == INPUT_LIST_EXPANDED
 
 
+def test_expand_refs_memoized():
+    input_ = {'a': [{'$ref': ID_FRAGMENT}, {'b': {'$ref': ID_FRAGMENT}}],
+              'c': {'$ref': ID_ABSPATH_FRAGMENT}}
+    with mock.patch('reschema.parser.Parser.expand_ref',
+                    side_effect=lambda base, ref: base + ref) as expand_ref:
+        refs = Parser.expand_refs(ID_BASE, input_)
+        assert expand_ref.call_count == 2
+
+    assert refs == set([ID_BASE + ID_FRAGMENT, ID_BASE + ID_ABSPATH_FRAGMENT])
+
+    assert input_['a'][1]['b']['$ref'] == ID_BASE + ID_FRAGMENT
+    assert input_['c']['$ref'] == ID_BASE + ID_ABSPATH_FRAGMENT
+
+
+def test_expanded_refs():
+    unchanged = {'b': [{'$ref': ID_BASE + ID_FRAGMENT}]}
+    input_ = {'a': [{'c': {'$ref': ID_FRAGMENT}}], 'd': unchanged}
+    saved = copy.deepcopy(input_)
+
+    # Deeper than the recursion limit
+    for _ in range(5000):
+        input_ = {'e': [input_]}
+
+    refs = set()
+    result = Parser.expanded_refs(ID_BASE, input_, refs)
+    assert refs == set([ID_BASE + ID_FRAGMENT])
+
+    for _ in range(5000):
+        input_ = input_['e'][0]
+        result = result['e'][0]
+    assert input_ == saved
+    assert result['a'][0]['c']['$ref'] == ID_BASE + ID_FRAGMENT
+    assert result['d'] is unchanged
+
+
 def test_preprocess():
     with mock.patch('reschema.parser.Parser.expand_refs'):
         Parser.preprocess(ID_BASE, copy.deepcopy(INPUT_LIST))
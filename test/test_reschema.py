@@ -4,11 +4,25 @@
 # accompanying the software ("License").  This software is distributed "AS IS"
 # as set forth in the License.
 
+import gc
+import io
 import os
+import asyncio
+import copy
+import datetime
+import shutil
 import logging
+import tempfile
+import time
 import unittest
+import threading
 import pytest
 import urllib.parse
+import weakref
+import concurrent.futures
+from collections import OrderedDict
+
+import mock
 
 from yaml.error import MarkedYAMLError
 
@@ -16,10 +30,16 @@ import reschema
 
 from reschema.exceptions import (ValidationError, NoManager,
                                  MissingParameter, ParseError,
-                                 InvalidReference)
+                                 InvalidReference, InvalidServiceId,
+                                 ReschemaLoadHookException,
+                                 InvalidServiceName, ReschemaException,
+                                 UnsupportedUpdate)
 
 from reschema.jsonschema import (Object, Integer, String, Array, Schema)
-from reschema import yaml_loader, ServiceDef, ServiceDefManager
+from reschema import (yaml_loader, binary_loader, ServiceDef,
+                      ServiceDefManager)
+from reschema.loader_nodes import SourceSpan
+from reschema.loadhooks import DirectoryLoadHook
 
 logger = logging.getLogger(__name__)
 
@@ -96,6 +116,53 @@ class TestReschema(unittest.TestCase):
         info = r.resources['info']
         self.assertFalse(hasattr(info.input, 'start_mark'))
 
+    def test_load_schema_binary(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for marks in (False, True):
+                filename = os.path.join(tmpdir, 'bookstore.rsb')
+                with open(BOOKSTORE_YAML, 'r') as f:
+                    obj = yaml_loader.marked_load(f)
+                with open(filename, 'wb') as f:
+                    binary_loader.dump(obj, f, marks=marks)
+
+                reschema.settings.MARKED_LOAD = True
+                r = ServiceDef.create_from_file(filename)
+                reschema.settings.MARKED_LOAD = False
+
+                self.assertEqual(r.name, 'bookstore')
+                self.assertEqual(r.check_references(), [])
+
+                info = r.resources['info']
+                self.assertEqual(hasattr(info.input, 'start_mark'), marks)
+                if marks:
+                    self.assertEqual(info.input.start_mark.line,
+                                     obj['resources']['info'].start_mark.line)
+                    self.assertEqual(info.input.start_mark.name,
+                                     BOOKSTORE_YAML)
+        finally:
+            reschema.settings.MARKED_LOAD = False
+            shutil.rmtree(tmpdir)
+
+    def test_binary_dates(self):
+        obj = yaml_loader.marked_load(
+            'a:\n'
+            '  day: 2019-01-01\n'
+            '  ts: 2019-01-01 10:00:00+01:00\n'
+            '  2020-02-02: [x, {b: 2019-03-03}]\n')
+        for marks in (False, True):
+            f = io.BytesIO()
+            binary_loader.dump(obj, f, marks=marks)
+            for load in (binary_loader.ordered_load,
+                         binary_loader.marked_load):
+                f.seek(0)
+                self.assertEqual(load(f), obj)
+        self.assertEqual(binary_loader.loads(binary_loader.dumps(obj)), obj)
+
+        with self.assertRaises(binary_loader.UnsupportedValue) as cm:
+            binary_loader.dumps({'a': [1, {'b': {1, 2}}]})
+        self.assertEqual(cm.exception.path, ['a', 1, 'b'])
+
     def test_unknown_schema(self):
         import tempfile
         fd, name = tempfile.mkstemp(suffix='.txt', text=True)
@@ -683,6 +750,59 @@ class TestJsonSchema(TestSchemaBase):
                             "default: 3\n")
         self.assertIsInstance(schema.str_detailed(), str)
 
+    def test_fingerprint(self):
+        text = ("type: object\n"
+                "description: {desc}\n"
+                "properties:\n"
+                "  name: {{ type: string, pattern: '^[a-z]+$' }}\n"
+                "  count: {{ type: integer, minimum: {minimum} }}\n"
+                "  tags: {{ type: array, items: {{ type: string }} }}\n"
+                "required: [name]\n")
+        a = self.parse(text.format(desc='A', minimum=1))
+        b = self.parse(text.format(desc='B', minimum=1))
+        c = self.parse(text.format(desc='C', minimum=2))
+
+        # Names and documentation don't matter, values and types do
+        self.assertEqual(a.fingerprint(), b.fingerprint())
+        self.assertNotEqual(a.fingerprint(), c.fingerprint())
+        self.assertEqual(a['name'].fingerprint(),
+                         c['name'].fingerprint())
+        self.assertNotEqual(a['name'].fingerprint(),
+                            a['tags'].items.fingerprint())
+        enums = set(self.parse("type: number\n"
+                               "enum: [%s]\n" % v).fingerprint()
+                    for v in ('1', '1.0', 'true'))
+        self.assertEqual(len(enums), 3)
+
+        # Identical constraints share one record and compiled pattern
+        self.assertIs(a['name']._constraints, b['name']._constraints)
+        self.assertIs(a._constraints, b._constraints)
+        self.assertIsNot(a['count']._constraints, c['count']._constraints)
+        self.check_valid(a['name'], valid=['abc'], invalid=['ABC'])
+        self.assertIs(a['name']._constraints.pattern,
+                      b['name']._constraints.pattern)
+
+        # Records hold plain immutable copies of the marked input
+        self.assertEqual(a.required, ['name'])
+        self.assertIs(type(a.required[0]), str)
+        self.assertFalse(hasattr(a.required, 'start_mark'))
+        with self.assertRaises(TypeError):
+            a.required.append('count')
+        self.assertEqual(b.required, ['name'])
+
+        # Setting a keyword replaces the record of that schema only,
+        # and the fingerprints of the schema and its parents
+        fingerprint = b.fingerprint()
+        b['count'].minimum = 1
+        self.assertEqual(b.fingerprint(), fingerprint)
+        b['count'].minimum = 2
+        self.assertEqual(a['count'].minimum, 1)
+        self.assertEqual(b['count'].minimum, 2)
+        self.check_valid(b['count'], valid=[2], invalid=[1])
+        self.assertEqual(b['count'].fingerprint(),
+                         c['count'].fingerprint())
+        self.assertEqual(b.fingerprint(), c.fingerprint())
+
     def test_timestamp(self):
         self.check_valid("type: timestamp\n",
 
@@ -1385,6 +1505,159 @@ class TestSchemaRef(TestSchemaBase):
                                   {'p1': True, 'p2': 'foo'}])
 
 
+class TestFreeze(TestSchemaBase):
+
+    SERVICE_DEF_CYCLE = """
+$schema: 'http://support.riverbed.com/apis/service_def/2.2'
+id: 'http://support.riverbed.com/apis/cycle/1.0'
+provider: 'riverbed'
+name: 'cycle'
+version: '1.0'
+types:
+   type_a: { $ref: '#/types/type_b' }
+   type_b: { $ref: '#/types/type_a' }
+"""
+
+    def setUp(self):
+        self.s1 = ServiceDef()
+        self.s1.load(SERVICE_DEF_TEST)
+        self.s2 = ServiceDef()
+        self.s2.load(SERVICE_DEF_TEST_REF)
+        self.manager = ServiceDefManager()
+        self.manager.add(self.s1)
+        self.manager.add(self.s2)
+
+    def test_freeze(self):
+        self.manager.freeze()
+        self.assertTrue(self.s1.frozen)
+        self.assertTrue(self.s2.frozen)
+
+        for e in self.s2.entity_iter():
+            if isinstance(e, Schema) and e.is_ref():
+                self.assertIsNotNone(e._refschema)
+                self.assertIsInstance(Schema.links.__get__(e), OrderedDict)
+
+        r = self.s2.find('#/resources/test_ref_remote_types')
+        (self.check_valid(r,
+                          valid=[{'prop_boolean': True,
+                                  'prop_number_limits': 12}],
+                          invalid=[{'prop_boolean': 1,
+                                    'prop_number_limits': 12}]))
+
+        r = self.s1.find('#/resources/test_merge_merge')
+        (self.check_valid(r,
+                          valid=[{'val': 15}, {'val': 20}],
+                          invalid=[{'val': 9}, {'val': 21}]))
+
+    def test_freeze_immutable(self):
+        self.manager.freeze()
+
+        sch = self.s1.types['type_number_limits']
+        with self.assertRaises(ReschemaException):
+            sch.minimum = 5
+        self.assertEqual(sch.minimum, 10)
+        with self.assertRaises(UnsupportedUpdate):
+            self.s1.update({})
+
+        # References of a frozen servicedef are kept
+        r = self.s2.find('#/resources/test_ref_remote_types')
+        sb = r['prop_boolean']._refschema
+        self.manager.remove(self.s1)
+        self.assertTrue(self.s2.frozen)
+        self.assertIs(r['prop_boolean']._refschema, sb)
+
+    def test_freeze_unresolved(self):
+        s = ServiceDef()
+        s.load(SERVICE_DEF_TEST_REF)
+        with self.assertRaises(NoManager):
+            s.freeze()
+        self.assertFalse(s.frozen)
+
+    def test_freeze_cycle(self):
+        s = ServiceDef.create_from_text(self.SERVICE_DEF_CYCLE,
+                                        format='yaml')
+        with self.assertRaises(InvalidReference) as cm:
+            s.freeze()
+        self.assertIn('circular', str(cm.exception))
+        self.assertFalse(s.frozen)
+
+
+class TestCache(TestSchemaBase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        reschema.settings.CACHE_DIR = self.cache_dir
+
+    def tearDown(self):
+        reschema.settings.CACHE_DIR = None
+        shutil.rmtree(self.cache_dir)
+
+    def test_cache(self):
+        s1 = ServiceDef.create_from_file(SERVICE_DEF_TEST)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+        with mock.patch.object(ServiceDef, 'parse') as parse:
+            s2 = ServiceDef.create_from_file(SERVICE_DEF_TEST)
+            self.assertFalse(parse.called)
+
+        self.assertEqual(s2.id, s1.id)
+        self.assertEqual(list(s2.types.keys()), list(s1.types.keys()))
+        self.assertIs(s2.types['type_object'].servicedef, s2)
+
+        manager = ServiceDefManager()
+        manager.add(s2)
+        self.assertIs(s2.types['type_object'].servicedef.manager, manager)
+        self.assertEqual(s2.check_references(), [])
+
+        r = s2.find('#/resources/test_merge_source_ref')
+        (self.check_valid(r,
+                          valid=[{'p1': 10}, {'p1': 20}],
+                          invalid=[{'p1': 9}, {'p1': 21}]))
+
+    def test_cache_options(self):
+        s1 = ServiceDef(release_input=True)
+        s1.load(SERVICE_DEF_TEST)
+        self.assertIsNone(s1.types['type_object']._input)
+
+        # A different entry, with the options of the loading instance
+        s2 = ServiceDef()
+        s2.load(SERVICE_DEF_TEST)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+        self.assertFalse(s2.release_input)
+        self.assertIsNotNone(s2.types['type_object']._input)
+
+        ServiceDef(readonly_input=True).load(SERVICE_DEF_TEST)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 3)
+
+        with mock.patch.object(ServiceDef, 'parse') as parse:
+            for options in ({}, {'release_input': True},
+                            {'readonly_input': True}):
+                s = ServiceDef(**options)
+                s.load(SERVICE_DEF_TEST)
+                for name in ('release_input', 'readonly_input'):
+                    self.assertEqual(getattr(s, name),
+                                     options.get(name, False))
+                self.assertEqual(s.types['type_object']._input is None,
+                                 s.release_input)
+            self.assertFalse(parse.called)
+
+    @unittest.skipUnless(hasattr(os, 'getuid'), 'POSIX only')
+    def test_cache_permissions(self):
+        # Created private
+        cache_dir = os.path.join(self.cache_dir, 'sub')
+        reschema.settings.CACHE_DIR = cache_dir
+        ServiceDef.create_from_file(SERVICE_DEF_TEST)
+        self.assertEqual(os.stat(cache_dir).st_mode & 0o777, 0o700)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        # Entries in a directory others can write are not loaded
+        os.chmod(cache_dir, 0o777)
+        with mock.patch('reschema.cache._Unpickler') as unpickler:
+            s = ServiceDef.create_from_file(SERVICE_DEF_TEST)
+            self.assertFalse(unpickler.called)
+        self.assertEqual(s.types['type_object'].name, 'type_object')
+
+
 class TestLoadHook(TestSchemaBase):
 
     def setUp(self):
@@ -1456,6 +1729,418 @@ class TestLoadHook(TestSchemaBase):
                          ('http://support.riverbed.com/apis/test/1.0'
                           '#/resources/test_boolean'))
 
+    def test_remove(self):
+        s = self.manager.find_by_id(
+            'http://support.riverbed.com/apis/test.ref/1.0')
+        r = s.resources['test_ref_remote_types']
+        sb = r.by_pointer('/prop_boolean')
+        remote = weakref.ref(sb.servicedef)
+        self.assertIs(s.find_schema_by_id(sb.fullid()), sb)
+
+        self.manager.remove(sb.servicedef)
+        del sb
+        gc.collect()
+        self.assertIsNone(remote())
+
+        # Resolved again, loading a new instance via the hook
+        sb = r.by_pointer('/prop_boolean')
+        self.assertIs(sb.servicedef,
+                      self.manager.find_by_id(
+                          'http://support.riverbed.com/apis/test/1.0'))
+        with self.assertRaises(InvalidServiceId):
+            self.manager.remove(
+                ServiceDef.create_from_file(SERVICE_DEF_TEST))
+
+    def test_capacity(self):
+        self.manager.capacity = 1
+        s = self.manager.pin('http://support.riverbed.com/apis/test.ref/1.0')
+        r = s.resources['test_ref_remote_types']
+        sb = r.by_pointer('/prop_boolean')
+        remote = weakref.ref(sb.servicedef)
+
+        # Pinned, so over capacity
+        self.assertEqual(len(self.manager.by_id), 2)
+        self.assertIs(self.manager.find_by_id(s.id), s)
+
+        # The least recently used one is evicted and freed
+        self.manager.unpin(s)
+        self.assertEqual(list(self.manager.by_id), [s.id])
+        self.assertEqual(self.manager.evictions, 1)
+        del sb
+        gc.collect()
+        self.assertIsNone(remote())
+
+        # Loaded again, evicting the other, which remains usable
+        sb = r.by_pointer('/prop_boolean')
+        self.assertEqual(list(self.manager.by_id), [sb.servicedef.id])
+        self.assertIs(s.find(sb.fullid()), sb)
+
+        with self.assertRaises(ReschemaException):
+            self.manager.unpin(s)
+
+        manager = ServiceDefManager(capacity_bytes=1)
+        manager.add(ServiceDef.create_from_file(SERVICE_DEF_TEST_REF))
+        s = ServiceDef.create_from_file(SERVICE_DEF_TEST)
+        manager.add(s)
+        self.assertEqual(list(manager.by_id), [s.id])
+        self.assertEqual(manager.total_size, s.estimated_size())
+
+    def test_prefetch(self):
+        sid = 'http://support.riverbed.com/apis/test/1.0'
+        s = ServiceDef.create_from_file(SERVICE_DEF_TEST_REF)
+        self.manager.add(s)
+        self.assertEqual(s.dependencies, set([sid]))
+
+        graph = self.manager.prefetch(s.id)
+        self.assertEqual(graph, {s.id: set([sid]), sid: set()})
+        self.assertIn(sid, self.manager.by_id)
+
+        # Missing dependencies are skipped
+        missing = 'http://support.riverbed.com/apis/missing/1.0'
+        with mock.patch.object(s, 'dependencies',
+                               frozenset([sid, missing])):
+            graph = self.manager.prefetch(s)
+        self.assertEqual(graph[missing], set())
+        self.assertNotIn(missing, self.manager.by_id)
+
+    def test_single_flight(self):
+        sid = 'http://support.riverbed.com/apis/test/1.0'
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        class SlowHook(object):
+            def find_by_id(self, id_):
+                calls.append(id_)
+                started.set()
+                release.wait(5)
+                if id_ != sid:
+                    raise KeyError(id_)
+                return ServiceDef.create_from_file(SERVICE_DEF_TEST)
+
+        waiting = threading.Semaphore(0)
+
+        class Future(concurrent.futures.Future):
+            def result(self, timeout=None):
+                waiting.release()
+                return super(Future, self).result(timeout)
+
+        manager = ServiceDefManager()
+        manager.add_load_hook(SlowHook())
+
+        for id_ in (sid, sid + '-missing'):
+            del calls[:]
+            started.clear()
+            release.clear()
+            results = []
+
+            def find():
+                try:
+                    results.append(manager.find_by_id(id_))
+                except ReschemaLoadHookException as e:
+                    results.append(e)
+
+            threads = [threading.Thread(target=find) for i in range(4)]
+            with mock.patch('reschema.servicedef.Future', Future):
+                threads[0].start()
+                started.wait(5)
+                for t in threads[1:]:
+                    t.start()
+                    waiting.acquire(timeout=5)
+                release.set()
+                for t in threads:
+                    t.join()
+
+            self.assertEqual(calls, [id_])
+            self.assertEqual(len(results), 4)
+            self.assertTrue(all(r is results[0] for r in results))
+
+        self.assertIs(results[0].__class__, ReschemaLoadHookException)
+
+    def test_negative_cache(self):
+        missing = 'http://support.riverbed.com/apis/missing/1.0'
+        hook = self.manager._load_hooks[0]
+
+        with mock.patch.object(hook, 'find_by_id',
+                               wraps=hook.find_by_id) as find_by_id:
+            # Disabled by default
+            for i in range(2):
+                with self.assertRaises(ReschemaLoadHookException):
+                    self.manager.find_by_id(missing)
+            self.assertEqual(find_by_id.call_count, 2)
+            self.assertEqual(self.manager.negative_cache_hits, 0)
+
+            self.manager.negative_cache_ttl = 60
+            find_by_id.reset_mock()
+            for i in range(3):
+                with self.assertRaises(ReschemaLoadHookException):
+                    self.manager.find_by_id(missing)
+            self.assertEqual(find_by_id.call_count, 1)
+            self.assertEqual(self.manager.negative_cache_hits, 2)
+
+            self.manager.invalidate_negative_cache(missing)
+            with self.assertRaises(ReschemaLoadHookException):
+                self.manager.find_by_id(missing)
+            self.assertEqual(find_by_id.call_count, 2)
+
+            # Expired entries are dropped
+            later = time.monotonic() + 61
+            with mock.patch('time.monotonic', return_value=later):
+                with self.assertRaises(ReschemaLoadHookException):
+                    self.manager.find_by_id(missing)
+            self.assertEqual(find_by_id.call_count, 3)
+            self.assertEqual(self.manager.negative_cache_misses, 5)
+
+    def test_find_async(self):
+        sid = 'http://support.riverbed.com/apis/test.ref/1.0'
+
+        async def find():
+            return await asyncio.gather(
+                self.manager.find_by_id_async(sid),
+                self.manager.find_by_id_async(sid),
+                self.manager.find_by_name_async('test.ref', '1.0'))
+
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(find())
+        finally:
+            loop.close()
+        self.assertEqual(results[0].id, sid)
+        self.assertTrue(all(r is results[0] for r in results))
+
+
+class TestDirectoryLoadHook(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.directory, 'test'))
+        for filename in (SERVICE_DEF_TEST, SERVICE_DEF_TEST_REF):
+            shutil.copy(filename, os.path.join(self.directory, 'test'))
+        shutil.copy(BOOKSTORE_JSON, self.directory)
+        self.index_file = os.path.join(self.directory, 'index.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_find(self):
+        manager = ServiceDefManager()
+        manager.add_load_hook(DirectoryLoadHook(self.directory))
+
+        s = manager.find_by_id('http://support.riverbed.com/apis/test.ref/1.0')
+        r = s.find('http://support.riverbed.com/apis/test/1.0'
+                   '#/types/type_boolean')
+        self.assertEqual(r.servicedef.name, 'test')
+
+        s = manager.find_by_name('bookstore', '1.0')
+        self.assertEqual(s.id,
+                         'http://support.riverbed.com/apis/bookstore/1.0')
+
+        with self.assertRaises(InvalidServiceName):
+            manager.find_by_name('bookstore', '2.0')
+
+    def test_headers_only(self):
+        hook = DirectoryLoadHook(self.directory)
+        with mock.patch('reschema.yaml_loader.ordered_load',
+                        side_effect=AssertionError), \
+                mock.patch('json.load', side_effect=AssertionError):
+            hook.refresh()
+        self.assertEqual(sorted(hook.by_name), [
+            ('bookstore', '1.0', 'riverbed'),
+            ('test', '1.0', 'riverbed'),
+            ('test.ref', '1.0', 'riverbed')])
+
+    def test_index_file(self):
+        DirectoryLoadHook(self.directory, self.index_file).refresh()
+
+        hook = DirectoryLoadHook(self.directory, self.index_file)
+        with mock.patch('reschema.loadhooks.read_header') as read_header:
+            self.assertIsNone(hook.find_by_id('http://example.com/missing'))
+        self.assertEqual(read_header.call_count, 0)
+        self.assertEqual(len(hook.by_id), 3)
+
+        # Modified, added and removed files are picked up on a miss
+        filename = os.path.join(self.directory, 'test', 'service_test.yaml')
+        with open(filename) as f:
+            text = f.read()
+        with open(filename, 'w') as f:
+            f.write(text.replace('apis/test/1.0', 'apis/test/1.1'))
+        os.rename(os.path.join(self.directory, 'bookstore.json'),
+                  os.path.join(self.directory, 'test', 'bookstore.json'))
+
+        hook = DirectoryLoadHook(self.directory, self.index_file)
+        s = hook.find_by_id('http://support.riverbed.com/apis/test/1.1')
+        self.assertEqual(s.id, 'http://support.riverbed.com/apis/test/1.1')
+        self.assertNotIn('http://support.riverbed.com/apis/test/1.0',
+                         hook.by_id)
+        self.assertEqual(
+            hook.by_name[('bookstore', '1.0', 'riverbed')],
+            os.path.join('test', 'bookstore.json'))
+
+    def test_rescan(self):
+        hook = DirectoryLoadHook(self.directory)
+        hook.refresh()
+
+        # Misses don't walk the tree while no directory was modified
+        with mock.patch('reschema.loadhooks.os.scandir') as scandir:
+            self.assertIsNone(hook.find_by_id('http://example.com/missing'))
+            self.assertIsNone(hook.find_by_name('missing', '1.0', 'x'))
+        self.assertEqual(scandir.call_count, 0)
+
+        # An added file is found on the next miss
+        dirname = os.path.join(self.directory, 'test')
+        with open(BOOKSTORE_JSON) as f:
+            text = f.read()
+        with open(os.path.join(dirname, 'bookstore.json'), 'w') as f:
+            f.write(text.replace('bookstore/1.0', 'bookstore/2.0')
+                        .replace('"1.0"', '"2.0"'))
+        # In case the filesystem's mtime resolution is too coarse
+        st = os.stat(dirname)
+        os.utime(dirname, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+        s = hook.find_by_name('bookstore', '2.0', 'riverbed')
+        self.assertEqual(s.id,
+                         'http://support.riverbed.com/apis/bookstore/2.0')
+
+
+class TestReload(unittest.TestCase):
+
+    TEST_ID = 'http://support.riverbed.com/apis/test/1.0'
+    TEST_REF_ID = 'http://support.riverbed.com/apis/test.ref/1.0'
+
+    def setUp(self):
+        # Servicedefs with compact marks are always replaced
+        patcher = mock.patch('reschema.settings.COMPACT_MARKS', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.directory = tempfile.mkdtemp()
+        shutil.copy(SERVICE_DEF_TEST_REF, self.directory)
+        self.filename = os.path.join(self.directory, 'service_test.yaml')
+        self.reset()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def reset(self):
+        shutil.copy(SERVICE_DEF_TEST, self.filename)
+        with open(self.filename) as f:
+            self.text = f.read()
+
+    def manager(self, **kwargs):
+        manager = ServiceDefManager()
+        manager.add_load_hook(DirectoryLoadHook(self.directory, **kwargs))
+        return manager
+
+    def edit(self, old, new):
+        self.text = self.text.replace(old, new, 1)
+        with open(self.filename, 'w') as f:
+            f.write(self.text)
+        # Don't depend on the resolution of file times
+        st = os.stat(self.filename)
+        os.utime(self.filename, ns=(st.st_atime_ns,
+                                    st.st_mtime_ns + 10 ** 9))
+
+    def test_reload_changed(self):
+        for lazy in (False, True):
+            with self.subTest(lazy=lazy):
+                self.reset()
+                manager = self.manager(lazy=lazy)
+                s = manager.find_by_id(self.TEST_ID)
+                r = manager.find_by_id(self.TEST_REF_ID).resources[
+                    'test_ref_remote_types']
+                self.assertIs(r.by_pointer('/prop_boolean'),
+                              s.types['type_boolean'])
+                type_number = s.types['type_number']
+                self.assertEqual(manager.reload_changed(), {})
+
+                self.edit('      default: True\n      enum: [ True ]',
+                          '      enum: [ False ]')
+                self.assertEqual(manager.reload_changed(), {
+                    self.TEST_ID: set([('types', 'type_boolean')])})
+                self.assertIs(manager.find_by_id(self.TEST_ID), s)
+                self.assertIs(s.types['type_number'], type_number)
+
+                # References into the new schema are resolved again
+                sb = r.by_pointer('/prop_boolean')
+                self.assertIs(sb, s.types['type_boolean'])
+                self.assertIs(s.find('#/types/type_boolean'), sb)
+                sb.validate(False)
+                with self.assertRaises(ValidationError):
+                    sb.validate(True)
+                self.assertEqual(manager.reload_changed(), {})
+
+    def test_reload_error(self):
+        manager = self.manager()
+        s = manager.find_by_id(self.TEST_ID)
+        type_boolean = s.types['type_boolean']
+
+        self.edit('      enum: [ True ]', '      enum: [ True ]\n      x: 1')
+        with self.assertRaises(ParseError):
+            s.reload()
+        self.assertIs(s.types['type_boolean'], type_boolean)
+        self.assertIs(s.find('#/types/type_boolean'), type_boolean)
+
+        # Not retried until modified again
+        self.assertFalse(s.source_changed())
+
+    def test_replace(self):
+        manager = self.manager()
+        s = manager.find_by_id(self.TEST_ID)
+        manager.pin(s)
+
+        self.edit('apis/test/1.0', 'apis/test/1.1')
+        self.assertEqual(manager.reload_changed(), {self.TEST_ID: None})
+        self.assertNotIn(self.TEST_ID, manager.by_id)
+        new = manager.find_by_id('http://support.riverbed.com/apis/test/1.1')
+        self.assertIsNot(new, s)
+        manager.unpin(new)
+
+    def test_reload_frozen(self):
+        manager = self.manager()
+        s = manager.find_by_id(self.TEST_ID)
+        ref = manager.find_by_id(self.TEST_REF_ID)
+        manager.freeze()
+
+        self.edit('      default: True\n      enum: [ True ]',
+                  '      enum: [ False ]')
+        self.assertEqual(manager.reload_changed(), {self.TEST_ID: None,
+                                                    self.TEST_REF_ID: None})
+
+        # Frozen dependents are replaced, so they don't use stale schemas
+        new = manager.find_by_id(self.TEST_ID)
+        new_ref = manager.find_by_id(self.TEST_REF_ID)
+        self.assertIsNot(new, s)
+        self.assertIsNot(new_ref, ref)
+        self.assertTrue(new.frozen)
+        self.assertTrue(new_ref.frozen)
+
+        sb = new_ref.resources['test_ref_remote_types'].by_pointer(
+            '/prop_boolean')
+        self.assertIs(sb, new.types['type_boolean'])
+        sb.validate(False)
+        with self.assertRaises(ValidationError):
+            sb.validate(True)
+
+    def test_watch(self):
+        manager = self.manager()
+        manager.find_by_id(self.TEST_ID)
+
+        reloaded = []
+        done = threading.Event()
+
+        def callback(result):
+            reloaded.append(result)
+            done.set()
+
+        stop = manager.watch(interval=0.01, callback=callback)
+        try:
+            self.edit('      enum: [ True ]', '      enum: [ True, False ]')
+            self.assertTrue(done.wait(5))
+        finally:
+            stop.set()
+        self.assertEqual(reloaded, [
+            {self.TEST_ID: set([('types', 'type_boolean')])}])
+
 
 class TestServiceDef(unittest.TestCase):
 
@@ -1502,6 +2187,203 @@ tags: {tags}
         service_def = self.create_service(tags='{hi: ~, quit: bye}')
         self.assertEqual(service_def.tags, {'hi': None, 'quit': 'bye'})
 
+    def test_merge_memo(self):
+        text = """
+$schema: 'http://support.riverbed.com/apis/service_def/2.2'
+id: 'http://support.riverbed.com/apis/merges/1.0'
+provider: 'riverbed'
+name: 'merges'
+version: '1.0'
+types:
+   base: { type: object, properties: { a: { type: integer } } }
+   m1:
+      $merge:
+         source: { $ref: '#/types/base' }
+         with: { properties: { b: { type: string } } }
+   m2:
+      $merge:
+         source: { $ref: '#/types/base' }
+         with: { properties: { b: { type: string } } }
+   nested:
+      $merge:
+         source: { $ref: '#/types/m1' }
+         with: { properties: { c: { type: string } } }
+   loop:
+      $merge:
+         source: { $ref: '#/types/loop' }
+         with: { properties: { c: { type: string } } }
+"""
+        servicedef = ServiceDef.create_from_text(text, format='yaml')
+        types = servicedef.types
+
+        with mock.patch('reschema.settings.MAX_MERGE_DEPTH', 1):
+            with self.assertRaises(InvalidReference):
+                types['nested'].refschema
+        types['nested'].validate({'a': 1, 'b': 'x', 'c': 'y'})
+
+        # Identical merges are evaluated once
+        self.assertIs(types['m1'].refschema.input,
+                      types['m2'].refschema.input)
+        types['m2'].validate({'a': 1, 'b': 'x'})
+
+        with self.assertRaises(InvalidReference):
+            types['loop'].refschema
+
+    def test_json_merge_patch(self):
+        from reschema.jsonmergepatch import json_merge_patch
+        servicedef = self.create_service()
+
+        unchanged = {'type': 'string'}
+        source = {'a': {'b': 1, 'c': unchanged}, 'd': unchanged, 'e': 2}
+        merged = json_merge_patch(servicedef, source,
+                                  {'a': {'b': 3}, 'e': None, 'f': [1]})
+        self.assertEqual(merged, {'a': {'b': 3, 'c': unchanged},
+                                  'd': unchanged, 'f': [1]})
+        self.assertEqual(source['a']['b'], 1)
+        self.assertIs(merged['a']['c'], unchanged)
+        self.assertIs(merged['d'], unchanged)
+
+        # Deeper than the recursion limit
+        source = {}
+        with_ = {'z': True}
+        for i in range(5000):
+            source = {'x': source, 'y': i}
+            with_ = {'x': with_}
+        merged = json_merge_patch(servicedef, source, with_)
+        while 'x' in merged:
+            self.assertIn('y', merged)
+            merged = merged['x']
+        self.assertEqual(merged, {'z': True})
+
+    def test_lazy(self):
+        manager = ServiceDefManager()
+        servicedef = ServiceDef(manager, lazy=True)
+        servicedef.load(SERVICE_DEF_TEST)
+        manager.add(servicedef)
+
+        self.assertIn('test_object_ref', servicedef.resources)
+        self.assertFalse(servicedef.resources.is_parsed('test_object_ref'))
+
+        # Only the referencing resource and its targets are parsed
+        r = servicedef.find('#/resources/test_object_ref')
+        r.validate({'prop_number_ref': 1})
+        self.assertTrue(servicedef.resources.is_parsed('test_object_ref'))
+        self.assertTrue(servicedef.types.is_parsed('type_number'))
+        self.assertFalse(servicedef.types.is_parsed('type_boolean'))
+
+        sch = servicedef.find_schema_by_id(
+            servicedef.id + '#/types/type_object_with_refs/properties/p1')
+        self.assertEqual(sch.fullname(), 'type_object_with_refs.p1')
+
+        self.assertEqual(servicedef.check_references(), [])
+        self.assertTrue(all(servicedef.types.is_parsed(t)
+                            for t in servicedef.types))
+
+    @mock.patch('reschema.settings.LOAD_DESCRIPTIONS', True)
+    def test_lean(self):
+        for filename in (SERVICE_DEF_TEST, BOOKSTORE_YAML, BOOKSTORE_JSON):
+            full = ServiceDef()
+            full.load(filename)
+            lean = ServiceDef(lean=True)
+            lean.load(filename)
+            self.assertIsNotNone(lean.lean_source)
+
+            for (e1, e2) in zip(full.entity_iter(), lean.entity_iter()):
+                for name in ('description', 'notes', 'example', 'tags',
+                             'xmlSchema', 'xmlExample'):
+                    if hasattr(e1, name):
+                        self.assertEqual(getattr(e1, name),
+                                         getattr(e2, name))
+
+        sch = lean.find('#/resources/book')
+        self.assertIsInstance(sch._example, SourceSpan)
+        self.assertEqual(sch.example['title'], 'My first book')
+
+    def test_lean_modified(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        filename = os.path.join(directory, 'bookstore.yaml')
+        shutil.copy(BOOKSTORE_YAML, filename)
+
+        lean = ServiceDef(lean=True)
+        lean.load(filename)
+        sch = lean.find('#/resources/book')
+        self.assertEqual(sch.example['title'], 'My first book')
+
+        # Edited in place, offsets no longer match
+        with open(filename, 'a') as f:
+            f.write('\n')
+        with self.assertRaises(ReschemaException):
+            sch.example
+
+        # Truncated
+        with open(filename, 'w') as f:
+            f.write('')
+        with self.assertRaises(ReschemaException):
+            sch.example
+
+    def test_release_input(self):
+        manager = ServiceDefManager()
+        servicedef = ServiceDef(manager, release_input=True)
+        servicedef.load(SERVICE_DEF_TEST)
+        manager.add(servicedef)
+
+        sch = servicedef.find('#/types/type_object')
+        self.assertIsNone(sch._input)
+        self.assertEqual(sch.input['properties']['p1'], {'type': 'number'})
+        self.assertEqual(sch['p1'].input, {'type': 'number'})
+
+        # $merge reads the input of the merge source
+        r = servicedef.find('#/resources/test_merge_source_ref')
+        r.validate({'p1': 15})
+        with self.assertRaises(ValidationError):
+            r.validate({'p1': 5})
+
+        with self.assertRaises(ValueError):
+            ServiceDef(lazy=True, release_input=True)
+
+    def test_release_input_dates(self):
+        text = (
+            "$schema: 'http://support.riverbed.com/apis/service_def/2.2'\n"
+            "id: 'http://support.riverbed.com/apis/dates/1.0'\n"
+            "provider: 'riverbed'\n"
+            "name: 'dates'\n"
+            "version: '1.0'\n"
+            "types:\n"
+            "   day: { type: string, example: 2019-01-01 }\n"
+            "   ts: { type: string, example: 2019-01-01 10:00:00 }\n"
+            "   tags: { type: string, example: !!set {a, b} }\n")
+        servicedef = ServiceDef(release_input=True)
+        servicedef.parse_text(text, format='yaml')
+
+        day = servicedef.find('#/types/day')
+        self.assertIsNone(day._input)
+        self.assertEqual(day.input['example'], datetime.date(2019, 1, 1))
+        self.assertEqual(servicedef.find('#/types/ts').input['example'],
+                         datetime.datetime(2019, 1, 1, 10))
+
+        # Sets can't be stored in the compact copy, the input is kept
+        tags = servicedef.find('#/types/tags')
+        self.assertIsNotNone(tags._input)
+        self.assertEqual(tags.input['example'], {'a', 'b'})
+
+    def test_readonly_input(self):
+        with open(SERVICE_DEF_TEST) as f:
+            raw = yaml_loader.marked_load(f)
+        orig = copy.deepcopy(raw)
+
+        for i in range(2):
+            manager = ServiceDefManager()
+            servicedef = ServiceDef(manager, readonly_input=True)
+            servicedef.parse(raw)
+            manager.add(servicedef)
+            self.assertEqual(servicedef.check_references(), [])
+            self.assertEqual(raw, orig)
+
+        ref = servicedef.find('#/types/type_ref_integer')
+        self.assertEqual(ref._refschema_id,
+                         servicedef.id + '#/types/type_integer')
+
 
 class TestI18N(unittest.TestCase):
 